@@ -23,7 +23,7 @@ extensions = [
     'sphinx.ext.mathjax',
     'sphinx_toolbox.more_autodoc.autonamedtuple'
 ]
-bibtex_bibfiles = ['attacks.bib', 'defenses.bib', 'datasets.bib']
+bibtex_bibfiles = ['attacks.bib', 'defenses.bib', 'datasets.bib', 'threats.bib', 'metrics.bib']
 
 templates_path = ['_templates']
 exclude_patterns = ['_build', 'Thumbs.db', '.DS_Store']
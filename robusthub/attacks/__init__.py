@@ -2,8 +2,11 @@ __all__ = ['attack']
 
 from robusthub.attacks.attack import Attack
 from robusthub.attacks.attack import load
+from robusthub.attacks.attack import attack_mode
 from robusthub.attacks.dummy import Dummy
 from robusthub.attacks.fgsm import FastGradientSignMethod
 from robusthub.attacks.pgd import ProjectedGradientDescent
 from robusthub.attacks.apgd import AutoProjectedGradientDescent
 from robusthub.attacks.simba import Simba
+from robusthub.attacks.cascade import Cascade
+from robusthub.attacks.minimal import MinimalPerturbation
@@ -3,15 +3,18 @@ import torch.nn.functional as F
 
 import numpy as np
 
+from typing import Tuple
+
 from robusthub.models import Model
 from robusthub.threats import ThreatModel
-from robusthub.attacks.attack import Attack, _grad_check
+from robusthub.attacks.attack import Attack, attack_mode, _StepKernel, _grad_check, _surrogate, _restarts, _track_best
 
 class AutoProjectedGradientDescent(Attack):
     """
     The AutoPGD attack proposed by :cite:`croce2020reliable`.
 
     The default values are the ones used in the paper. It is not recommended to modify them.
+    As in the paper, the step size and the checkpoint conditions are tracked for every sample separately.
 
     Parameters
     -----------
@@ -38,6 +41,23 @@ class AutoProjectedGradientDescent(Attack):
     
     device
         Device to use.
+    
+    batch_restarts
+        Optimize the random restarts simultaneously as one large batch instead of one after another.
+    
+    max_batch_size
+        Maximum number of samples in a batch of restarts. Restarts are split into chunks that respect this limit.
+        By default, all restarts are optimized at once.
+    
+    early_stop
+        Stop optimizing samples as soon as they are misclassified.
+    
+    tol
+        Stop optimizing samples whose loss changes by less than this amount in an iteration.
+    
+    compiled
+        Fuse the update step and projection into a kernel compiled with :code:`torch.compile`.
+        Falls back to eager execution if compilation is not available.
     """
     def __init__(self,
                  threat_model: ThreatModel,
@@ -47,7 +67,12 @@ class AutoProjectedGradientDescent(Attack):
                  rho: float = .75,
                  restarts: int = 5,
                  sigma: float = .01,
-                 device: torch.device = torch.device('cuda')):
+                 device: torch.device = torch.device('cuda'),
+                 batch_restarts: bool = False,
+                 max_batch_size: int | None = None,
+                 early_stop: bool = False,
+                 tol: float | None = None,
+                 compiled: bool = False):
         super().__init__(threat_model)
 
         self.iterations = iterations
@@ -57,75 +82,113 @@ class AutoProjectedGradientDescent(Attack):
         self.restarts = restarts
         self.sigma = sigma
         self.device = device
+        self.batch_restarts = batch_restarts
+        self.max_batch_size = max_batch_size
+        self.early_stop = early_stop
+        self.tol = tol
+        self.step = _StepKernel(self._step, compiled)
     
     def apply(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> torch.Tensor:
-        # track best set of adversarial examples
+        with attack_mode(model), self.threat.bind(x_data):
+            surrogate = _surrogate(model)
+            return _restarts(lambda x, y: self._run(surrogate, x, y),
+                             x_data, y_data, self.restarts, self.batch_restarts, self.max_batch_size)
+
+    def _run(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        bs = x_data.shape[0]
+
+        # track best set of adversarial examples per sample
         x_best = x_data.detach().clone()
-        best_loss = -torch.inf
+        best_loss = torch.full((bs,), -torch.inf, device=x_data.device)
+        best_fooled = torch.zeros(bs, dtype=torch.bool, device=x_data.device)
 
-        # do a number of random restarts
-        for _ in range(self.restarts):
-            # initialize run with noisy samples
-            noise = self.sigma * torch.randn_like(x_data)
-            x_adv = self.threat.project(x_data, x_data.detach().clone() + noise)
-            x_adv.requires_grad = True
-            x_prev = x_data.detach().clone()
-
-            # initialize checkpoints
-            checkpoint = 0
-            p_prev = 0
-            p_next = .22
-            improvement_counter = 0
-            eta = self.eta
-            eta_prev = self.eta
-            best_loss_prev = best_loss
-
-            # iteratively optimize the perturbations
-            for i in range(self.iterations):
-                # get loss gradients
+        # samples that are still being optimized
+        active = torch.arange(bs, device=x_data.device)
+        x_orig, y_orig = x_data, y_data
+        loss_prev = None
+
+        # initialize run with noisy samples
+        noise = self.sigma * torch.randn_like(x_data)
+        x_adv = self.threat.project(x_data, x_data.detach().clone() + noise)
+        x_adv.requires_grad = True
+        x_prev = x_data.detach().clone()
+
+        # initialize checkpoints
+        p_prev = 0
+        p_next = .22
+        checkpoint = int(np.ceil(p_next * self.iterations))
+        improvement_counter = torch.zeros(bs, device=x_data.device)
+        eta = torch.full((bs,), self.eta, device=x_data.device)
+        eta_prev = eta.clone()
+        best_loss_prev = best_loss.clone()
+
+        # iteratively optimize the perturbations
+        for i in range(self.iterations + 1):
+            # get loss gradients, the final iterate is only evaluated
+            final = i == self.iterations
+            with torch.set_grad_enabled(not final):
                 y_pred = model(x_adv)
-                loss = F.nll_loss(y_pred, y_data)
+                loss = F.nll_loss(y_pred, y_orig, reduction='none')
+            if not final:
                 _grad_check(loss)
-                loss.backward()
-
-                with torch.no_grad():
-                    # update perturbations
-                    z = self.threat.project(x_data, x_adv + eta * torch.sign(x_adv.grad))
-                    x_next = self.threat.project(x_data,
-                                                 x_adv
-                                                + self.alpha * (z - x_adv)
-                                                + (1 - self.alpha) * (x_adv - x_prev))
-                    x_prev = x_adv.detach().clone()
-                    x_adv = x_next.detach().clone()
-
-                    # check new best
-                    y_pred = model(x_adv)
-                    loss = F.nll_loss(y_pred, y_data).item()
-                    if loss > best_loss:
-                        # record improvement
-                        best_loss_prev = best_loss
-                        best_loss = loss
-                        x_best = x_adv.detach().clone()
-                        improvement_counter += 1
-                    
-                    # checkpoint
-                    if i >= checkpoint:
-                        # check conditions C1 and C2
-                        period = (p_next - p_prev) * self.iterations
-                        c1 = (improvement_counter / period < self.rho)
-                        c2 = (np.isclose(eta, eta_prev) and np.isclose(best_loss, best_loss_prev))
-                        if c1 or c2:
-                            # halve step size and reset
-                            eta_prev = eta
-                            eta /= 2
-                            x_adv = x_best.detach().clone()
-
-                        # reset counters
-                        improvement_counter = 0
-
-                        # set next checkpoint
-                        checkpoint = int(np.ceil(p_next * self.iterations))
-                        p_next = p_next + max(p_next - p_prev - .03, .06)
-                x_adv.requires_grad = True
-
-        return x_best
+                grad, = torch.autograd.grad(loss.sum(), x_adv)
+
+            with torch.no_grad():
+                # check new best using the loss of the current iterate
+                loss = loss.detach()
+                fooled = y_pred.argmax(dim=1) != y_orig
+                improved = _track_best(x_best, best_loss, best_fooled, active, x_adv, loss, fooled, self.early_stop)
+                improvement_counter.index_add_(0, active, improved.float())
+                if final:
+                    break
+
+                # update perturbations
+                step = eta[active].view(-1, *[1] * (x_adv.ndim - 1))
+                x_next = self.step(x_adv.detach(), x_prev, grad, x_orig, step)
+                x_prev = x_adv.detach()
+                x_adv = x_next
+                
+                # checkpoint
+                if i >= checkpoint:
+                    # check conditions C1 and C2
+                    period = (p_next - p_prev) * self.iterations
+                    c1 = improvement_counter / period < self.rho
+                    c2 = (eta == eta_prev) & (best_loss == best_loss_prev)
+                    reset = c1 | c2
+
+                    # halve step size and reset
+                    eta_prev = eta.clone()
+                    eta = torch.where(reset, eta / 2, eta)
+                    best_loss_prev = best_loss.clone()
+                    x_adv = torch.where(reset[active].view(-1, *[1] * (x_adv.ndim - 1)), x_best[active], x_adv)
+
+                    # reset counters
+                    improvement_counter.zero_()
+
+                    # set next checkpoint
+                    p_prev, p_next = p_next, p_next + max(p_next - p_prev - .03, .06)
+                    checkpoint = int(np.ceil(p_next * self.iterations))
+
+                # drop samples that no longer need to be optimized
+                if self.early_stop or self.tol is not None:
+                    keep = torch.ones_like(loss, dtype=torch.bool)
+                    if self.early_stop:
+                        keep &= ~fooled
+                    if self.tol is not None and loss_prev is not None:
+                        keep &= torch.abs(loss - loss_prev) > self.tol
+                    loss_prev = loss
+                    if not keep.all():
+                        active, x_adv, x_prev, x_orig, y_orig, loss_prev = \
+                            active[keep], x_adv[keep], x_prev[keep], x_orig[keep], y_orig[keep], loss_prev[keep]
+                        if active.numel() == 0:
+                            break
+            x_adv.requires_grad = True
+
+        return x_best, best_loss, best_fooled
+
+    def _step(self, x_adv: torch.Tensor, x_prev: torch.Tensor, grad: torch.Tensor, x_orig: torch.Tensor, step: torch.Tensor) -> torch.Tensor:
+        z = self.threat.project(x_orig, x_adv + step * torch.sign(grad))
+        return self.threat.project(x_orig,
+                                   x_adv
+                                  + self.alpha * (z - x_adv)
+                                  + (1 - self.alpha) * (x_adv - x_prev))
@@ -7,9 +7,15 @@ subject to the constraints defined by a given threat model.
 """
 import torch
 
+import contextlib
+
+import warnings
+
 from abc import ABC, abstractmethod
 
-from robusthub.models import Model
+from typing import Callable, Dict, Tuple
+
+from robusthub.models import Model, eval_mode
 from robusthub.threats import ThreatModel
 from robusthub.utils import _get_github, _load_local
 
@@ -48,6 +54,18 @@ class Attack(ABC):
         """
         pass
 
+    def statistics(self) -> Dict[str, torch.Tensor]:
+        """
+        Per-sample statistics of the most recent call to :py:meth:`apply`, such as the number of model queries.
+        Benchmarks report the average of every statistic over the data set.
+
+        Returns
+        --------
+        Dict[str, torch.Tensor]
+            Mapping of statistic names to tensors with one value per sample. Empty by default.
+        """
+        return {}
+
 def load(repo: str, ident: str, source: str = 'github', force_reload: bool = False, **kwargs) -> Attack:
     """
     Load an adversarial attack from a given repository.
@@ -88,5 +106,127 @@ def load(repo: str, ident: str, source: str = 'github', force_reload: bool = Fal
 
     return attack
 
+@contextlib.contextmanager
+def attack_mode(model: Model):
+    """
+    Context manager that prepares a model for an attack.
+
+    Within the context, the model is in evaluation mode and its parameters do not require gradients,
+    so attacks only compute gradients with respect to their inputs and do not disturb e.g. batch normalization statistics.
+    The original state of the model is restored when the context is exited.
+
+    Parameters
+    -----------
+    model
+        The model to attack.
+    """
+    params = list(model.parameters())
+    requires_grad = [param.requires_grad for param in params]
+
+    for param in params:
+        param.requires_grad_(False)
+    try:
+        with eval_mode(model):
+            yield model
+    finally:
+        for param, flag in zip(params, requires_grad):
+            param.requires_grad_(flag)
+
+class _StepKernel:
+    """
+    Attack step function that is optionally compiled with :code:`torch.compile`.
+
+    The function is compiled once with dynamic shapes, so batches of different sizes, such as the shrinking
+    active sets of attacks with early stopping, reuse the same kernel instead of triggering recompilation.
+    If compilation is disabled or fails, the step function runs eagerly.
+    """
+    def __init__(self, fn: Callable[..., torch.Tensor], enabled: bool):
+        self.fn = fn
+        self.enabled = enabled and hasattr(torch, 'compile')
+        self.kernel = torch.compile(fn, dynamic=True) if self.enabled else None
+
+    def __call__(self, *args) -> torch.Tensor:
+        if not self.enabled:
+            return self.fn(*args)
+
+        try:
+            return self.kernel(*args)
+        except Exception as e:
+            warnings.warn(f'Compilation of attack step failed, falling back to eager mode: {e}')
+            self.enabled = False
+            return self.fn(*args)
+
+def _surrogate(model: Model) -> Model:
+    """
+    Differentiable surrogate of a model for gradient-based attacks, see :py:meth:`robusthub.models.Model.surrogate`.
+    Models that do not define a surrogate, such as plain PyTorch modules, are their own surrogate.
+    """
+    surrogate = getattr(model, 'surrogate', None)
+    return surrogate() if callable(surrogate) else model
+
 def _grad_check(x: torch.Tensor):
     assert x.requires_grad and x.grad_fn is not None, 'This attack can only be applied to differentiable models.'
+
+def _track_best(x_best: torch.Tensor,
+                best_loss: torch.Tensor,
+                best_fooled: torch.Tensor,
+                active: torch.Tensor,
+                x_adv: torch.Tensor,
+                loss: torch.Tensor,
+                fooled: torch.Tensor,
+                force: bool = False) -> torch.Tensor:
+    """
+    Update the per-sample best adversarial examples, their losses and whether they fool the model in place.
+
+    The :code:`active` indices map the rows of :code:`x_adv`, :code:`loss` and :code:`fooled` to rows of the best tensors.
+    If :code:`force` is set, fooling samples are always updated. Returns the mask of updated samples.
+    """
+    improved = loss > best_loss[active]
+    if force:
+        improved = improved | fooled
+    best_loss.index_copy_(0, active, torch.where(improved, loss, best_loss[active]))
+    best_fooled.index_copy_(0, active, torch.where(improved, fooled, best_fooled[active]))
+    x_best.index_copy_(0, active, torch.where(improved.view(-1, *[1] * (x_adv.ndim - 1)), x_adv, x_best[active]))
+    return improved
+
+def _restarts(run: Callable[[torch.Tensor, torch.Tensor], Tuple[torch.Tensor, torch.Tensor, torch.Tensor]],
+              x_data: torch.Tensor,
+              y_data: torch.Tensor,
+              restarts: int,
+              batched: bool,
+              max_batch_size: int | None) -> torch.Tensor:
+    """
+    Run an attack with several random restarts and keep the best restart for every sample.
+
+    Restarts that fool the model are preferred over those that do not, ties are broken by the highest loss.
+    If :code:`batched` is set, the data is tiled so that multiple restarts are optimized as one large batch
+    of at most :code:`max_batch_size` samples. Otherwise, restarts are run one after another.
+    The :code:`run` function must return the adversarial examples together with their per-sample losses
+    and whether they fool the model.
+    """
+    bs = x_data.shape[0]
+    if not batched:
+        chunk = 1
+    elif max_batch_size is None:
+        chunk = restarts
+    else:
+        chunk = max(1, min(restarts, max_batch_size // bs))
+
+    x_best = x_data.detach().clone()
+    best_loss = torch.full((bs,), -torch.inf, device=x_data.device)
+    best_fooled = torch.zeros(bs, dtype=torch.bool, device=x_data.device)
+    samples = torch.arange(bs, device=x_data.device)
+    for start in range(0, restarts, chunk):
+        n = min(chunk, restarts - start)
+        x_adv, losses, fooled = run(x_data.repeat(n, *[1] * (x_data.ndim - 1)), y_data.repeat(n))
+        x_adv, losses, fooled = x_adv.view(n, *x_data.shape), losses.view(n, bs), fooled.view(n, bs)
+
+        # select the best restart of this chunk for every sample, only considering fooling restarts if there are any
+        ranked = torch.where(fooled | ~fooled.any(dim=0), losses, -torch.inf)
+        idx = ranked.argmax(dim=0)
+        chunk_loss, chunk_fooled = losses[idx, samples], fooled[idx, samples]
+        improved = (chunk_fooled & ~best_fooled) | ((chunk_fooled == best_fooled) & (chunk_loss > best_loss))
+        best_loss = torch.where(improved, chunk_loss, best_loss)
+        best_fooled = torch.where(improved, chunk_fooled, best_fooled)
+        x_best = torch.where(improved.view(-1, *[1] * (x_data.ndim - 1)), x_adv[idx, samples], x_best)
+    return x_best
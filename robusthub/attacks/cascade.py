@@ -0,0 +1,62 @@
+import torch
+
+from typing import Dict, List
+
+from robusthub.models import Model
+from robusthub.attacks.attack import Attack
+
+class Cascade(Attack):
+    """
+    Ensemble of attacks that are applied one after another, in the spirit of AutoAttack :cite:`croce2020reliable`.
+    
+    Every attack is only applied to the samples that the model still classifies correctly,
+    so cheap attacks such as :py:class:`robusthub.attacks.fgsm.FastGradientSignMethod` should come first
+    and expensive attacks such as :py:class:`robusthub.attacks.apgd.AutoProjectedGradientDescent` last.
+    Samples that are misclassified without perturbation are not attacked at all.
+    
+    The statistics of the individual attacks are summed per sample. The :code:`Stage` statistic
+    records the number of attacks that were applied to every sample.
+    
+    Parameters
+    -----------
+    attacks
+        List of attacks to apply (first to last). The threat model of the cascade is the one of the first attack.
+    """
+    def __init__(self, attacks: List[Attack]):
+        super().__init__(attacks[0].threat)
+        self.attacks = attacks
+        self.stats = {}
+    
+    def apply(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> torch.Tensor:
+        # check the data bounds once for all stages
+        with self.threat.bind(x_data):
+            x_adv = x_data.detach().clone()
+            stages = torch.zeros(x_data.shape[0], dtype=torch.long, device=x_data.device)
+            self.stats = {}
+        
+            # only attack samples that are classified correctly
+            with torch.no_grad():
+                remaining = torch.nonzero(model(x_data).argmax(dim=1) == y_data).view(-1)
+        
+            for attack in self.attacks:
+                if remaining.numel() == 0:
+                    break
+            
+                # attack the remaining samples
+                x_stage = attack.apply(model, x_data[remaining], y_data[remaining])
+                x_adv.index_copy_(0, remaining, x_stage.detach())
+                stages.index_add_(0, remaining, torch.ones_like(remaining))
+                for name, values in attack.statistics().items():
+                    totals = self.stats.setdefault(name, torch.zeros(x_data.shape[0], dtype=values.dtype, device=x_data.device))
+                    totals.index_add_(0, remaining, values)
+            
+                # pass on the samples that are still classified correctly
+                with torch.no_grad():
+                    survived = model(x_stage).argmax(dim=1) == y_data[remaining]
+                remaining = remaining[survived]
+        
+            self.stats['Stage'] = stages
+            return x_adv
+    
+    def statistics(self) -> Dict[str, torch.Tensor]:
+        return self.stats
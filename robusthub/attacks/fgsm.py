@@ -2,7 +2,7 @@ import torch
 import torch.nn.functional as F
 
 from robusthub.models import Model
-from robusthub.attacks.attack import Attack, _grad_check
+from robusthub.attacks.attack import Attack, attack_mode, _grad_check, _surrogate
 from robusthub.threats import ThreatModel
 
 class FastGradientSignMethod(Attack):
@@ -16,29 +16,35 @@ class FastGradientSignMethod(Attack):
     
     eps
         Multiplier for the gradient sign vector.
+    
+    sigma
+        Magnitude of the uniform random initialization of the perturbations, as in :cite:`wong2020attack`. No random initialization by default.
     """
     def __init__(self,
                  threat_model: ThreatModel,
-                 eps: float = 1):
+                 eps: float = 1,
+                 sigma: float = 0):
         super().__init__(threat_model)
         self.eps = eps
+        self.sigma = sigma
     
     def apply(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> torch.Tensor:
-        x_adv = x_data.clone().detach()
-        x_adv.requires_grad = True
-
-        y_pred = model(x_adv)
-        loss = F.nll_loss(y_pred, y_data)
-        _grad_check(loss)
-        loss.backward()
+        with self.threat.bind(x_data):
+            x_adv = x_data.clone().detach()
+            if self.sigma > 0:
+                noise = self.sigma * (2 * torch.rand_like(x_data) - 1)
+                x_adv = self.threat.project(x_data, x_adv + noise)
+            x_adv.requires_grad = True
 
-        with torch.no_grad():
-            deltas = self.eps * torch.sign(x_adv.grad)
-            x_adv = x_adv + deltas
-            x_adv = self.threat.project(x_data, x_adv)
+            with attack_mode(model):
+                y_pred = _surrogate(model)(x_adv)
+                loss = F.nll_loss(y_pred, y_data)
+                _grad_check(loss)
+                grad, = torch.autograd.grad(loss, x_adv)
 
-        x_adv.grad = None
-        loss.grad = None
-        model.zero_grad()
+            with torch.no_grad():
+                deltas = self.eps * torch.sign(grad)
+                x_adv = x_adv + deltas
+                x_adv = self.threat.project(x_data, x_adv)
 
-        return x_adv.detach()
+            return x_adv.detach()
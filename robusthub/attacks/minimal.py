@@ -0,0 +1,83 @@
+import torch
+
+import numpy as np
+
+from typing import Dict
+
+from robusthub.models import Model
+from robusthub.threats import _find_lp
+from robusthub.attacks.attack import Attack
+
+class MinimalPerturbation(Attack):
+    """
+    Estimate the minimal adversarial perturbation of every sample with a given attack.
+    
+    The attack is applied once at its full budget. For every sample it fools, a batched binary search along
+    the line between the original and the adversarial sample then finds the smallest scaling of the perturbation
+    that still fools the model. This only requires forward passes of the model.
+    The norm of the scaled perturbation is an upper bound on the minimal adversarial budget of the sample,
+    which is available as :py:attr:`epsilon` after each call to :py:meth:`apply`. It is zero for samples that are
+    misclassified without perturbation and infinite for samples that the attack does not fool.
+    The adversarial examples of the attack itself are returned unchanged, so metrics are still computed at the full budget.
+    
+    Upper bounds on robust accuracy at any budget up to the one of the attack follow from these values, which allows
+    evaluating many budgets with a single attack. Since only a single perturbation direction per sample is searched,
+    these bounds are looser than running the attack at each budget. See :py:class:`robusthub.benchmarks.Benchmark`.
+    
+    Parameters
+    -----------
+    attack
+        The attack to use.
+    
+    p
+        Norm in which the perturbations are measured. Defaults to the norm of the :math:`L_p` threat model of the attack.
+    
+    steps
+        Number of binary search steps.
+    """
+    def __init__(self, attack: Attack, p: float | None = None, steps: int = 10):
+        super().__init__(attack.threat)
+        if p is None:
+            lp = _find_lp(attack.threat)
+            if lp is None:
+                raise ValueError(f'Threat model {attack.threat} does not contain an Lp threat model, please specify the norm')
+            p = lp.p
+        
+        self.attack = attack
+        self.p = p
+        self.steps = steps
+        self.epsilon = None
+    
+    def apply(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> torch.Tensor:
+        x_adv = self.attack.apply(model, x_data, y_data).detach()
+        
+        with torch.no_grad():
+            bs = x_data.shape[0]
+            shape = (-1, *[1] * (x_data.ndim - 1))
+            deltas = x_adv - x_data
+            clean = model(x_data).argmax(dim=1) != y_data
+            fooled = clean | (model(x_adv).argmax(dim=1) != y_data)
+            
+            # search the smallest fooling scale of every successful perturbation
+            t_low = torch.zeros(bs, dtype=x_data.dtype, device=x_data.device)
+            t_high = torch.where(clean, t_low, torch.ones_like(t_low))
+            active = torch.nonzero(fooled & ~clean).view(-1)
+            for _ in range(self.steps):
+                if active.numel() == 0:
+                    break
+                t_mid = (t_low[active] + t_high[active]) / 2
+                y_pred = model(x_data[active] + t_mid.view(shape) * deltas[active])
+                ok = y_pred.argmax(dim=1) != y_data[active]
+                t_high.index_copy_(0, active, torch.where(ok, t_mid, t_high[active]))
+                t_low.index_copy_(0, active, torch.where(ok, t_low[active], t_mid))
+            
+            norms = torch.linalg.vector_norm(deltas.view(bs, -1), self.p, dim=1)
+            lp = _find_lp(self.threat)
+            if lp is not None and lp.p == self.p:
+                # rounding must not push perturbations at the full budget beyond it
+                norms = torch.clamp(norms, max=lp.epsilon)
+            self.epsilon = torch.where(fooled, t_high * norms, torch.full_like(norms, np.inf))
+        return x_adv
+    
+    def statistics(self) -> Dict[str, torch.Tensor]:
+        return self.attack.statistics()
@@ -1,9 +1,11 @@
 import torch
 import torch.nn.functional as F
 
+from typing import Tuple
+
 from robusthub.models import Model
 from robusthub.threats import ThreatModel
-from robusthub.attacks.attack import Attack, _grad_check
+from robusthub.attacks.attack import Attack, attack_mode, _StepKernel, _grad_check, _surrogate, _restarts, _track_best
 
 class ProjectedGradientDescent(Attack):
     """
@@ -28,6 +30,23 @@ class ProjectedGradientDescent(Attack):
     
     device
         Device to use.
+    
+    batch_restarts
+        Optimize the random restarts simultaneously as one large batch instead of one after another.
+    
+    max_batch_size
+        Maximum number of samples in a batch of restarts. Restarts are split into chunks that respect this limit.
+        By default, all restarts are optimized at once.
+    
+    early_stop
+        Stop optimizing samples as soon as they are misclassified.
+    
+    tol
+        Stop optimizing samples whose loss changes by less than this amount in an iteration.
+    
+    compiled
+        Fuse the update step and projection into a kernel compiled with :code:`torch.compile`.
+        Falls back to eager execution if compilation is not available.
     """
     def __init__(self,
                  threat_model: ThreatModel,
@@ -35,7 +54,12 @@ class ProjectedGradientDescent(Attack):
                  alpha: float = .01,
                  restarts: int = 5,
                  sigma: float = .01,
-                 device: torch.device = torch.device('cuda')):
+                 device: torch.device = torch.device('cuda'),
+                 batch_restarts: bool = False,
+                 max_batch_size: int | None = None,
+                 early_stop: bool = False,
+                 tol: float | None = None,
+                 compiled: bool = False):
         super().__init__(threat_model)
 
         self.iterations = iterations
@@ -43,39 +67,72 @@ class ProjectedGradientDescent(Attack):
         self.restarts = restarts
         self.sigma = sigma
         self.device = device
+        self.batch_restarts = batch_restarts
+        self.max_batch_size = max_batch_size
+        self.early_stop = early_stop
+        self.tol = tol
+        self.step = _StepKernel(self._step, compiled)
     
     def apply(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> torch.Tensor:
-        # track best set of adversarial examples
+        with attack_mode(model), self.threat.bind(x_data):
+            surrogate = _surrogate(model)
+            return _restarts(lambda x, y: self._run(surrogate, x, y),
+                             x_data, y_data, self.restarts, self.batch_restarts, self.max_batch_size)
+
+    def _run(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        # track best set of adversarial examples per sample
         x_best = x_data.detach().clone()
-        best_loss = -torch.inf
+        best_loss = torch.full((x_data.shape[0],), -torch.inf, device=x_data.device)
+        best_fooled = torch.zeros(x_data.shape[0], dtype=torch.bool, device=x_data.device)
 
-        # do a number of random restarts
-        for _ in range(self.restarts):
-            # initialize run with noisy samples
-            noise = self.sigma * torch.randn_like(x_data)
-            x_adv = self.threat.project(x_data, x_data.detach().clone() + noise)
-            x_adv.requires_grad = True
+        # samples that are still being optimized
+        active = torch.arange(x_data.shape[0], device=x_data.device)
+        x_orig, y_orig = x_data, y_data
+        loss_prev = None
+
+        # initialize run with noisy samples
+        noise = self.sigma * torch.randn_like(x_data)
+        x_adv = self.threat.project(x_data, x_data.detach().clone() + noise)
+        x_adv.requires_grad = True
 
-            # iteratively optimize the perturbations
-            for _ in range(self.iterations):
-                # get loss gradients
+        # iteratively optimize the perturbations
+        for i in range(self.iterations + 1):
+            # get loss gradients, the final iterate is only evaluated
+            final = i == self.iterations
+            with torch.set_grad_enabled(not final):
                 y_pred = model(x_adv)
-                loss = F.nll_loss(y_pred, y_data)
+                loss = F.nll_loss(y_pred, y_orig, reduction='none')
+            if not final:
                 _grad_check(loss)
-                loss.backward()
+                grad, = torch.autograd.grad(loss.sum(), x_adv)
 
-                with torch.no_grad():
-                    # update perturbations
-                    deltas = self.alpha * torch.sign(x_adv.grad)
-                    x_adv = x_adv + deltas
-                    x_adv = self.threat.project(x_data, x_adv)
+            with torch.no_grad():
+                # check new best using the loss of the current iterate
+                loss = loss.detach()
+                fooled = y_pred.argmax(dim=1) != y_orig
+                _track_best(x_best, best_loss, best_fooled, active, x_adv, loss, fooled, self.early_stop)
+                if final:
+                    break
+
+                # update perturbations
+                x_adv = self.step(x_adv.detach(), grad, x_orig)
+
+                # drop samples that no longer need to be optimized
+                if self.early_stop or self.tol is not None:
+                    keep = torch.ones_like(loss, dtype=torch.bool)
+                    if self.early_stop:
+                        keep &= ~fooled
+                    if self.tol is not None and loss_prev is not None:
+                        keep &= torch.abs(loss - loss_prev) > self.tol
+                    loss_prev = loss
+                    if not keep.all():
+                        active, x_adv, x_orig, y_orig, loss_prev = active[keep], x_adv[keep], x_orig[keep], y_orig[keep], loss_prev[keep]
+                        if active.numel() == 0:
+                            break
+            x_adv.requires_grad = True
 
-                    # check new best
-                    y_pred = model(x_adv)
-                    loss = F.nll_loss(y_pred, y_data).item()
-                    if loss > best_loss:
-                        best_loss = loss
-                        x_best = x_adv.detach().clone()
-                x_adv.requires_grad = True
+        return x_best, best_loss, best_fooled
 
-        return x_best
+    def _step(self, x_adv: torch.Tensor, grad: torch.Tensor, x_orig: torch.Tensor) -> torch.Tensor:
+        deltas = self.alpha * torch.sign(grad)
+        return self.threat.project(x_orig, x_adv + deltas)
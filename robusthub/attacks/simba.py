@@ -1,18 +1,41 @@
 import torch
 
-import scipy.fftpack as fft
+import numpy as np
+
+from functools import lru_cache
+
+from typing import Dict
 
 from robusthub.models import Model
 from robusthub.threats import ThreatModel
 from robusthub.attacks.attack import Attack
 
+@lru_cache(maxsize=16)
+def _dct_matrix(n: int, device: torch.device, dtype: torch.dtype) -> torch.Tensor:
+    k = torch.arange(n, dtype=torch.float64).view(-1, 1)
+    i = torch.arange(n, dtype=torch.float64).view(1, -1)
+    d = np.sqrt(2 / n) * torch.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    d[0] /= np.sqrt(2)
+    return d.to(device=device, dtype=dtype)
+
 def idct2(x: torch.Tensor) -> torch.Tensor:
-    return torch.from_numpy(fft.idct(fft.idct(x.cpu().detach().numpy(), axis=0, norm='ortho'), axis=1, norm='ortho')).to(x.device)
+    """
+    Orthonormal 2D inverse DCT over the last two dimensions, computed with cached DCT matrices on the device of the input.
+    """
+    d_h = _dct_matrix(x.shape[-2], x.device, x.dtype)
+    d_w = _dct_matrix(x.shape[-1], x.device, x.dtype)
+    return d_h.T @ x @ d_w
 
 class Simba(Attack):
     """
     The simple black-box attack proposed by :cite:`guo2019simple`.
+    
+    All samples in a batch are attacked simultaneously. In every iteration, a number of candidate perturbations
+    is evaluated for each sample in a single batched model call. The best candidate is accepted for every sample
+    where it lowers the model output for the true class.
 
+    The number of model queries spent on each sample is available through :py:meth:`statistics`.
+    
     Parameters
     -----------
     threat_model
@@ -26,32 +49,81 @@ class Simba(Attack):
     
     basis
         Basis to use. Options are :code:`standard` for the standard Cartesian basis or :code:`dct` for the DCT basis.
+    
+    candidates
+        Number of candidate perturbations per sample and iteration.
+    
+    max_queries
+        Maximum number of model queries per sample, including the initial query on the clean sample.
+    
+    early_stop
+        Stop querying samples as soon as they are misclassified.
     """
     def __init__(self,
                  threat_model: ThreatModel,
                  iterations: int = 500,
                  eps: float = .1,
-                 basis: str = 'standard'):
+                 basis: str = 'standard',
+                 candidates: int = 1,
+                 max_queries: int | None = None,
+                 early_stop: bool = False):
         super().__init__(threat_model)
-
+        
         self.iterations = iterations
         self.eps = eps
         self.basis = basis
+        self.candidates = candidates
+        self.max_queries = max_queries
+        self.early_stop = early_stop
+        self.queries = None
     
     def apply(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> torch.Tensor:
-        deltas = torch.zeros_like(x_data)
-        bs = x_data.shape[0]
-        y_pred_old = model(x_data)
-        for _ in range(self.iterations):
-            qs = self.eps * torch.randn_like(x_data)
-            if self.basis == 'dct':
-                qs = idct2(qs)
-            x_tilde = self.threat.project(x_data, x_data + deltas + qs)
-
-            y_pred_new = model(x_tilde)
-            for i in range(bs):
-                if y_pred_old[i, y_data[i]] > y_pred_new[i, y_data[i]]:
-                    deltas[i, ...] = deltas[i, ...] + qs[i, ...]
-            y_pred_old = y_pred_new.clone()
-
-        return self.threat.project(x_data, x_data + deltas)
+        with self.threat.bind(x_data), torch.no_grad():
+            bs, k = x_data.shape[0], self.candidates
+            shape = (-1, *[1] * (x_data.ndim - 1))
+            deltas = torch.zeros_like(x_data)
+            self.queries = torch.ones(bs, dtype=torch.long, device=x_data.device)
+
+            y_pred = model(x_data)
+            y_score = y_pred.gather(1, y_data.view(-1, 1)).view(-1)
+            fooled = y_pred.argmax(dim=1) != y_data
+            active = torch.arange(bs, device=x_data.device)
+            for _ in range(self.iterations):
+                # only query samples that are within budget and, optionally, not yet misclassified
+                if self.early_stop or self.max_queries is not None:
+                    keep = torch.ones_like(active, dtype=torch.bool)
+                    if self.early_stop:
+                        keep &= ~fooled[active]
+                    if self.max_queries is not None:
+                        keep &= self.queries[active] + k <= self.max_queries
+                    active = active[keep]
+                    if active.numel() == 0:
+                        break
+                n = active.numel()
+                x_orig, y_orig = x_data[active], y_data[active]
+
+                # evaluate all candidates in one model call
+                qs = self.eps * torch.randn(k, *x_orig.shape, dtype=x_data.dtype, device=x_data.device)
+                if self.basis == 'dct':
+                    qs = idct2(qs)
+                x_tilde = self.threat.project(x_orig.repeat(k, *[1] * (x_data.ndim - 1)),
+                                              (x_orig + deltas[active] + qs).flatten(0, 1))
+                y_pred = model(x_tilde).view(k, n, -1)
+                self.queries.index_add_(0, active, torch.full_like(active, k))
+
+                # accept the best candidate wherever it lowers the score of the true class
+                samples = torch.arange(n, device=x_data.device)
+                y_score_new = y_pred.gather(2, y_orig.view(1, -1, 1).expand(k, -1, 1)).view(k, n)
+                best = y_score_new.argmin(dim=0)
+                y_score_new = y_score_new[best, samples]
+                improved = y_score_new < y_score[active]
+                deltas.index_copy_(0, active, torch.where(improved.view(shape), deltas[active] + qs[best, samples], deltas[active]))
+                y_score.index_copy_(0, active, torch.where(improved, y_score_new, y_score[active]))
+                fooled.index_copy_(0, active, torch.where(improved, y_pred[best, samples].argmax(dim=1) != y_orig, fooled[active]))
+        
+            return self.threat.project(x_data, x_data + deltas)
+    
+    def statistics(self) -> Dict[str, torch.Tensor]:
+        if self.queries is None:
+            return {}
+        return {'Queries': self.queries}
@@ -19,32 +19,42 @@ strategy which we implement in the dashboard app; we still record raw measuremen
 
 Task-specific metrics must be specified by the user and are detailed in our :doc:`Metrics <metrics>` page.
 All task-specific metrics are computed using the robust model on clean as well as adversarially corrupted data.
+
+Attacks may additionally report per-sample statistics such as the number of model queries
+(see :py:meth:`robusthub.attacks.attack.Attack.statistics`). Their averages over the data set are recorded as well.
+
+Benchmarks can also record upper bounds on robust accuracy at several attack budgets at once. In this case, the attack is wrapped in
+:py:class:`robusthub.attacks.minimal.MinimalPerturbation` and the robust accuracy at each budget is derived from
+an upper bound on the minimal adversarial budget of every sample, found by a line search along the perturbation of the attack.
+These records are labeled as upper bounds, since they can be higher than the robust accuracy of the attack run at that budget.
 """
 
-from typing import List, NamedTuple, Union
+from typing import Dict, List, NamedTuple, Union
+
+import warnings
 
 from enum import Flag, auto
 
 import torch
 
-import numpy as np
-
 from robusthub import models
 from robusthub import defenses
 from robusthub import attacks
 from robusthub import metrics
+from robusthub import threats
 from robusthub.profiler import Profiler
+from robusthub.execution import ExecutionPolicy
 
 
 class Value(NamedTuple):
     """
-    Represents the average value of a metric over a data set.
+    Represents the value of a metric over a data set.
     """
 
-    #: Mean of the metric values over the data set.
+    #: Value of the metric over the data set.
     mean: float
 
-    #: Standard error of the mean of values over the data set.
+    #: Half-width of the 95% confidence interval of the value.
     err: float
 
     def __repr__(self):
@@ -70,6 +80,9 @@ class ResultFlags(Flag):
     #: This value applies to the defense.
     DEFENSE = auto()
 
+    #: This value applies to the attack.
+    ATTACK = auto()
+
     #: This value was measured in the standard (non-adversarial) setting.
     STANDARD = auto()
 
@@ -83,10 +96,13 @@ class Result:
     def __init__(self):
         self.record = []
 
-    def store(self, metric: Union[metrics.Metric, str], t: ResultFlags, value: Value):
+    def store(self, metric: Union[metrics.Metric, str], t: ResultFlags, value: Union[Value, metrics.Accumulator]):
         """
         Store a result.
 
+        Accumulators are reduced to a :py:class:`Value` at this point, which is the only time
+        their state is synchronized with the host.
+
         Parameters
         -----------
         metric
@@ -96,11 +112,14 @@ class Result:
             Flags describing the type of measurement.
         
         value
-            The measured value.
+            The measured value or an accumulator of the metric.
         
         bounds
             Lower and upper bounds of the metric, if any.
         """
+        if isinstance(value, metrics.Accumulator):
+            value = Value(*value.result())
+
         if isinstance(metric, metrics.Metric):
             record = {
                 'metric': metric.name,
@@ -122,6 +141,14 @@ class Benchmark:
     """
     Base class for all benchmarks.
 
+    By default, the benchmark makes separate passes over the data for profiling the standard model,
+    profiling the robust model and computing the task-specific metrics.
+    In fused mode, all of these are performed in a single pass over the data, so every batch is loaded
+    and copied to the device only once. Only the forward passes themselves are profiled in this case.
+
+    After the defense is applied, the standard and robust model are evaluated in evaluation mode.
+    The training mode of their modules is restored at the end of the run.
+
     Parameters
     -----------
     attack
@@ -132,11 +159,33 @@ class Benchmark:
     
     device
         Torch device.
+
+    fused
+        Evaluate everything in a single pass over the data.
+    
+    policy
+        Execution policy for inference with the standard and robust model.
+    
+    epsilons
+        Attack budgets at which to additionally record upper bounds on robust accuracy, measured in the norm of the threat model.
+        They are recorded as :code:`Accuracy(eps=..., upper bound)`. The budgets should not exceed the budget of the attack,
+        since samples that the attack does not fool are counted as robust at every budget.
     """
-    def __init__(self, attack: attacks.Attack, metrics_list: List[metrics.Metric], device: torch.device = torch.device('cuda')):
+    def __init__(self, attack: attacks.Attack, metrics_list: List[metrics.Metric], device: torch.device = torch.device('cuda'), fused: bool = False,
+                 policy: ExecutionPolicy = ExecutionPolicy(), epsilons: List[float] | None = None):
+        if epsilons is not None and not isinstance(attack, attacks.MinimalPerturbation):
+            attack = attacks.MinimalPerturbation(attack)
+        if epsilons is not None:
+            lp = threats._find_lp(attack.threat)
+            if lp is not None and max(epsilons) > lp.epsilon:
+                warnings.warn(f'Budgets {epsilons} exceed the budget of the attack ({lp.epsilon}), robust accuracy will be overestimated')
+
         self.attack = attack
         self.metrics = metrics_list
         self.device = device
+        self.fused = fused
+        self.policy = policy
+        self.epsilons = epsilons
 
     def run(self, model: models.Model, defense: defenses.Defense, data_loader: torch.utils.data.DataLoader) -> Result:
         """
@@ -159,13 +208,14 @@ class Benchmark:
             An object describing the benchmark results.
         """
         result = Result()
-        model = model.to(self.device)
+        model = self.policy.prepare(model.to(self.device))
         profiler = Profiler(self.device)
 
         # Profile defense
         print('[*] Profiling defense')
         with profiler:
             robust_model = defense.apply(model)
+        robust_model = self.policy.prepare(robust_model)
         result.store('Memory',
                      ResultFlags.AGNOSTIC | ResultFlags.DEFENSE,
                      Value(mean=profiler.memory, err=0))
@@ -173,49 +223,118 @@ class Benchmark:
                      ResultFlags.AGNOSTIC | ResultFlags.DEFENSE,
                      Value(mean=profiler.runtime, err=0))
 
+        # evaluate both models in evaluation mode, so that e.g. batch normalization statistics do not drift
+        with models.eval_mode(model), models.eval_mode(robust_model):
+            if self.fused:
+                self._run_fused(result, model, robust_model, data_loader)
+            else:
+                self._run_sequential(result, model, robust_model, data_loader)
+
+        return result
+
+    def _run_sequential(self, result: Result, model: models.Model, robust_model: models.Model, data_loader: torch.utils.data.DataLoader):
+        profiler = Profiler(self.device)
+
         # Profile standard model inference
         print('[*] Profiling standard model')
         with profiler:
             for x_data, _ in data_loader:
-                model(x_data.to(self.device))
-        result.store('Memory',
-                     ResultFlags.AGNOSTIC | ResultFlags.MODEL | ResultFlags.STANDARD,
-                     Value(mean=profiler.memory, err=0))
-        result.store('Runtime',
-                     ResultFlags.AGNOSTIC | ResultFlags.MODEL | ResultFlags.STANDARD,
-                     Value(mean=profiler.runtime, err=0))
+                self.policy(model, x_data.to(self.device))
+        self._store_profile(result, ResultFlags.STANDARD, profiler)
 
         # Profile robust model inference
         print('[*] Profiling robust model')
         with profiler:
             for x_data, _ in data_loader:
-                robust_model(x_data.to(self.device))
+                self.policy(robust_model, x_data.to(self.device))
+        self._store_profile(result, ResultFlags.ROBUST, profiler)
+
+        # Measure task-specific metrics
+        print('[*] Calculating task-specific metrics')
+        evaluation = _Evaluation(self.attack, self.metrics, self.policy, self.epsilons)
+        for x_data, y_data in data_loader:
+            x_data, y_data = x_data.to(self.device), y_data.to(self.device)
+            y_standard = self.policy(robust_model, x_data)
+            evaluation.update(robust_model, x_data, y_data, y_standard)
+        evaluation.store(result)
+
+    def _run_fused(self, result: Result, model: models.Model, robust_model: models.Model, data_loader: torch.utils.data.DataLoader):
+        standard_profiler = Profiler(self.device, cumulative=True)
+        robust_profiler = Profiler(self.device, cumulative=True)
+
+        print('[*] Profiling models and calculating task-specific metrics')
+        evaluation = _Evaluation(self.attack, self.metrics, self.policy, self.epsilons)
+        for x_data, y_data in data_loader:
+            x_data, y_data = x_data.to(self.device), y_data.to(self.device)
+            with standard_profiler:
+                self.policy(model, x_data)
+            with robust_profiler:
+                y_standard = self.policy(robust_model, x_data)
+            evaluation.update(robust_model, x_data, y_data, y_standard)
+
+        self._store_profile(result, ResultFlags.STANDARD, standard_profiler)
+        self._store_profile(result, ResultFlags.ROBUST, robust_profiler)
+        evaluation.store(result)
+
+    def _store_profile(self, result: Result, setting: ResultFlags, profiler: Profiler):
         result.store('Memory',
-                     ResultFlags.AGNOSTIC | ResultFlags.MODEL | ResultFlags.ROBUST,
+                     ResultFlags.AGNOSTIC | ResultFlags.MODEL | setting,
                      Value(mean=profiler.memory, err=0))
         result.store('Runtime',
-                     ResultFlags.AGNOSTIC | ResultFlags.MODEL | ResultFlags.ROBUST,
+                     ResultFlags.AGNOSTIC | ResultFlags.MODEL | setting,
                      Value(mean=profiler.runtime, err=0))
 
-        # Measure task-specific metrics
-        print('[*] Calculating task-specific metrics')
-        for metric in self.metrics:
-            standard_values = []
-            robust_values = []
-            for x_data, y_data in data_loader:
-                x_data, y_data = x_data.to(self.device), y_data.to(self.device)
-                x_tilde = self.attack.apply(robust_model, x_data, y_data)
-
-                standard_value = metric.compute(robust_model, x_data, y_data)
-                robust_value = metric.compute(robust_model, x_tilde, y_data)
-
-                standard_values.append(standard_value)
-                robust_values.append(robust_value)
+class _Evaluation:
+    """
+    Streaming evaluation of the task-specific metrics and attack statistics over a data set.
+    """
+    def __init__(self, attack: attacks.Attack, metrics_list: List[metrics.Metric], policy: ExecutionPolicy, epsilons: List[float] | None = None):
+        self.attack = attack
+        self.metrics = metrics_list
+        self.policy = policy
+        self.standard = [metric.accumulator() if metrics._scores(metric) else metrics.BatchMean(_values) for metric in metrics_list]
+        self.robust = [metric.accumulator() if metrics._scores(metric) else metrics.BatchMean(_values) for metric in metrics_list]
+        self.statistics: Dict[str, metrics.Accumulator] = {}
+        self.epsilons = epsilons or []
+        self.curve = [metrics.SampleMean(_values) for _ in self.epsilons]
+
+    def update(self, robust_model: models.Model, x_data: torch.Tensor, y_data: torch.Tensor, y_standard: torch.Tensor):
+        with attacks.attack_mode(robust_model):
+            x_tilde = self.attack.apply(robust_model, x_data, y_data)
+        for name, values in self.attack.statistics().items():
+            self.statistics.setdefault(name, metrics.SampleMean(_values)).update(values, y_data)
+        for eps, accuracy in zip(self.epsilons, self.curve):
+            accuracy.update((self.attack.epsilon > eps).float(), y_data)
+
+        # share a single clean and adversarial forward pass among all metrics
+        y_robust = self.policy(robust_model, x_tilde)
+        for metric, standard, robust in zip(self.metrics, self.standard, self.robust):
+            if metrics._scores(metric):
+                standard.update(y_standard, y_data)
+                robust.update(y_robust, y_data)
+                continue
+
+            # metrics that only implement compute run the model themselves
+            with self.policy.context():
+                standard.update(metric.compute(robust_model, x_data, y_data), y_data)
+                robust.update(metric.compute(robust_model, x_tilde, y_data), y_data)
+
+    def store(self, result: Result):
+        for metric, standard, robust in zip(self.metrics, self.standard, self.robust):
             result.store(metric,
                          ResultFlags.SPECIFIC | ResultFlags.STANDARD,
-                         Value(mean=np.mean(standard_values), err=1.96*np.std(standard_values)/np.sqrt(len(standard_values))))
+                         standard)
             result.store(metric,
                          ResultFlags.SPECIFIC | ResultFlags.ROBUST,
-                         Value(mean=np.mean(robust_values), err=1.96*np.std(robust_values)/np.sqrt(len(robust_values))))
-
-        return result
+                         robust)
+        for eps, accuracy in zip(self.epsilons, self.curve):
+            result.store(f'Accuracy(eps={eps:g}, upper bound)',
+                         ResultFlags.SPECIFIC | ResultFlags.ROBUST,
+                         accuracy)
+        for name, values in self.statistics.items():
+            result.store(name,
+                         ResultFlags.AGNOSTIC | ResultFlags.ATTACK,
+                         values)
+
+def _values(values: torch.Tensor, _: torch.Tensor) -> torch.Tensor:
+    return values
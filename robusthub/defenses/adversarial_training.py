@@ -13,10 +13,10 @@ import copy
 
 from typing import Callable
 
-from robusthub.threats import ThreatModel
+from robusthub.threats import ThreatModel, _find_lp
 from robusthub.models import Model
 from robusthub.defenses import Defense
-from robusthub.attacks import Attack, ProjectedGradientDescent
+from robusthub.attacks import Attack, FastGradientSignMethod, ProjectedGradientDescent
 
 from tqdm import tqdm
 
@@ -24,6 +24,17 @@ class AdversarialTraining(Defense):
     """
     Basic adversarial training defense as proposed by :cite:`madry2017defense`.
 
+    Two cheaper variants are available through the :code:`mode` parameter:
+
+    * :code:`fast` trains on FGSM adversarial examples with random initialization :cite:`wong2020defense`.
+    * :code:`free` replays every minibatch several times and reuses the input gradients of every weight update
+      to update a perturbation that persists across minibatches :cite:`shafahi2019adversarial`.
+      Every epoch costs as much as :code:`replays` epochs of standard training, so the number of epochs should be reduced accordingly.
+
+    Both variants take their budget from the :math:`L_p` threat model contained in :code:`threat_model`.
+    Unless another attack is given, both also select the model on the validation data with the FGSM attack of the
+    :code:`fast` mode, since a full PGD attack on the validation data would cost more than the training itself.
+
     Parameters
     -----------
     training_data
@@ -39,7 +50,9 @@ class AdversarialTraining(Defense):
         Number of epochs of training.
     
     attack
-        Adversarial attack to use for training. Defaults to :py:class:`robusthub.attacks.pgd.ProjectedGradientDescent` with :code:`restarts=1`.
+        Adversarial attack to use for training and validation. Defaults to :py:class:`robusthub.attacks.pgd.ProjectedGradientDescent` with :code:`restarts=1`
+        in :code:`pgd` mode and to :py:class:`robusthub.attacks.fgsm.FastGradientSignMethod` with random initialization otherwise.
+        In :code:`free` mode, the attack is only used for validation.
     
     optimizer
         Optimizer to use for training.
@@ -49,6 +62,12 @@ class AdversarialTraining(Defense):
 
     device
         PyTorch device.
+    
+    mode
+        Training mode. One of :code:`pgd`, :code:`fast` or :code:`free`.
+    
+    replays
+        Number of replays of every minibatch in :code:`free` mode.
     """
     def __init__(self,
                  training_data: torch.utils.data.DataLoader,
@@ -58,7 +77,9 @@ class AdversarialTraining(Defense):
                  attack: Attack | None = None,
                  optimizer: torch.optim.Optimizer = torch.optim.Adam,
                  criterion: Callable = torch.nn.CrossEntropyLoss(),
-                 device: torch.device = torch.device('cuda')):
+                 device: torch.device = torch.device('cuda'),
+                 mode: str = 'pgd',
+                 replays: int = 4):
         super().__init__()
 
         self.training_data = training_data
@@ -69,8 +90,20 @@ class AdversarialTraining(Defense):
         self.optimizer = optimizer
         self.criterion = criterion
         self.device = device
-
-        if attack is None:
+        self.mode = mode
+        self.replays = replays
+
+        if mode not in ('pgd', 'fast', 'free'):
+            raise ValueError(f'Unknown adversarial training mode: {mode}')
+        if mode != 'pgd':
+            lp = _find_lp(threat_model)
+            if lp is None:
+                raise ValueError(f'Adversarial training in {mode} mode requires an Lp threat model, got {threat_model}')
+            self.eps = lp.epsilon
+
+        if attack is None and mode != 'pgd':
+            self.attack = FastGradientSignMethod(threat_model, eps=1.25 * self.eps, sigma=self.eps)
+        elif attack is None:
             self.attack = ProjectedGradientDescent(threat_model, restarts=1, device=device)
 
     def apply(self, model: Model) -> Model:
@@ -93,8 +126,12 @@ class AdversarialTraining(Defense):
         best_params = copy.deepcopy(new_model.state_dict())
         for epoch in range(self.nb_epochs):
             progbar = tqdm(self.training_data, desc=f'Epoch {epoch + 1} / {self.nb_epochs}')
+            deltas = None
             for x_data, y_data in progbar:
                 x_data, y_data = x_data.to(self.device), y_data.to(self.device)
+                if self.mode == 'free':
+                    deltas = self._replay(new_model, optimizer, x_data, y_data, deltas)
+                    continue
                 x_tilde = self.attack.apply(new_model, x_data, y_data)
 
                 optimizer.zero_grad()
@@ -118,3 +155,23 @@ class AdversarialTraining(Defense):
 
         new_model.load_state_dict(best_params)
         return new_model
+
+    def _replay(self, model: Model, optimizer: torch.optim.Optimizer, x_data: torch.Tensor, y_data: torch.Tensor, deltas: torch.Tensor | None) -> torch.Tensor:
+        """
+        Train on a minibatch for free adversarial training and return the updated perturbations.
+        """
+        if deltas is None or deltas.shape != x_data.shape:
+            deltas = torch.zeros_like(x_data)
+        for _ in range(self.replays):
+            x_tilde = self.threat.project(x_data, x_data + deltas).requires_grad_()
+
+            # a single backward pass yields gradients for both the weights and the perturbations
+            optimizer.zero_grad()
+            y_pred = model(x_tilde)
+            loss = self.criterion(y_pred, y_data)
+            loss.backward()
+            optimizer.step()
+
+            with torch.no_grad():
+                deltas = self.threat.project(x_data, x_tilde + self.eps * torch.sign(x_tilde.grad)) - x_data
+        return deltas
@@ -8,6 +8,14 @@ Catalog of randomized smoothing defenses.
 import torch
 import torch.nn.functional as F
 
+import math
+
+import numpy as np
+
+from scipy.stats import beta, binom, norm
+
+from typing import Iterable, Iterator, Tuple
+
 from robusthub.models import Model, CompositeModel
 from robusthub.defenses.defense import Defense
 
@@ -28,21 +36,218 @@ class SmoothedModel(Model):
     
     n_classes
         Number of classes.
+    
+    max_batch_size
+        Maximum number of noisy samples passed through the model at once. Noise draws for the whole batch are
+        stacked into chunks of at most this size. Defaults to the batch size, i.e., one noise draw per model call.
+    
+    eot_samples
+        Number of noise draws of the differentiable surrogate used by gradient-based attacks. See :py:meth:`surrogate`.
     """
-    def __init__(self, model: Model, n_samples: int, sigma: float, n_classes: int):
+    def __init__(self, model: Model, n_samples: int, sigma: float, n_classes: int, max_batch_size: int | None = None, eot_samples: int = 1):
         super().__init__()
         self.model = model
         self.n_samples = n_samples
         self.sigma = sigma
         self.n_classes = n_classes
+        self.max_batch_size = max_batch_size
+        self.eot_samples = eot_samples
     
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        y_outputs = []
-        for _ in range(self.n_samples):
-            eta = self.sigma * torch.randn_like(x)
-            y_outputs.append(self.model(x + eta))
-        y_preds = torch.stack([torch.argmax(y_output, dim=1) for y_output in y_outputs], dim=0)
-        return F.one_hot(torch.mode(y_preds, dim=0)[0], self.n_classes).float()
+        return F.one_hot(torch.argmax(self.counts(x), dim=1), self.n_classes).float()
+    
+    def counts(self, x: torch.Tensor, n: int | None = None) -> torch.Tensor:
+        """
+        Count the classes predicted by the base model for noisy copies of the samples.
+
+        Parameters
+        -----------
+        x
+            Input tensor.
+        
+        n
+            Number of noise draws per sample. Defaults to the number of samples of this model.
+        
+        Returns
+        --------
+        torch.Tensor
+            Class counts of shape :code:`(batch_size, n_classes)`.
+        """
+        counts = torch.zeros(x.shape[0], self.n_classes, dtype=torch.long, device=x.device)
+        with torch.no_grad():
+            # reduce every chunk to class counts right away
+            for x_noisy, draws in self._noisy_chunks(x, self.n_samples if n is None else n):
+                y_preds = torch.argmax(self.model(x_noisy), dim=1).view(draws, -1).T
+                counts.scatter_add_(1, y_preds, torch.ones_like(y_preds))
+        return counts
+    
+    def surrogate(self) -> Model:
+        """
+        Differentiable surrogate for expectation over transformation (EOT) attacks :cite:`athalye2018synthesizing`.
+
+        The surrogate averages the softmax outputs of the base model over :code:`eot_samples` noise draws,
+        which are passed through the base model as a single batch, and returns the log of the averaged probabilities.
+        Gradients of losses of the surrogate are therefore averaged over the noise in one backward pass.
+
+        Returns
+        --------
+        Model
+            The surrogate model.
+        """
+        return _SmoothedSurrogate(self)
+    
+    def certify(self,
+                x: torch.Tensor,
+                n0: int,
+                n: int,
+                alpha: float = .001,
+                radius: float = 0,
+                looks: int = 1) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Certify the predictions of the smoothed model with the CERTIFY procedure of :cite:`cohen2019certified`.
+
+        A first set of noise draws selects the top class of every sample. A separate set of draws estimates a
+        one-sided Clopper-Pearson lower bound on its probability, from which the certified :math:`L_2` radius follows.
+        
+        The estimation draws can be split into several looks. After every look, samples whose bound is decided
+        with respect to the target radius stop drawing noise. Each look uses a Bonferroni-corrected level
+        :math:`\\alpha / \\mathrm{looks}`, so the guarantee holds regardless of when a sample stops. Radii of samples
+        that stop early are based on fewer draws and are therefore more conservative.
+
+        Parameters
+        -----------
+        x
+            Input tensor.
+        
+        n0
+            Number of noise draws for selecting the top class.
+        
+        n
+            Maximum number of noise draws for estimating the probability of the top class.
+        
+        alpha
+            Probability that the certificate of a sample is wrong.
+        
+        radius
+            Target radius used to decide early stopping.
+        
+        looks
+            Number of looks at the estimation draws.
+        
+        Returns
+        --------
+        Tuple[torch.Tensor, torch.Tensor]
+            Predicted classes, which are -1 for abstentions, and certified radii, which are 0 for abstentions.
+        """
+        bs = x.shape[0]
+        c_hat = torch.argmax(self.counts(x, n0), dim=1)
+        threshold = norm.cdf(radius / self.sigma)
+        level = alpha / looks
+        
+        n_top = np.zeros(bs, dtype=np.int64)
+        n_total = np.zeros(bs, dtype=np.int64)
+        active = np.arange(bs)
+        for look in range(looks):
+            if active.size == 0:
+                break
+            
+            # draw noise only for undecided samples
+            draws = n // looks + (1 if look < n % looks else 0)
+            index = torch.as_tensor(active, device=x.device)
+            counts = self.counts(x[index], draws)
+            n_top[active] += counts.gather(1, c_hat[index].view(-1, 1)).view(-1).cpu().numpy()
+            n_total[active] += draws
+            
+            lower = _lower_bound(n_top[active], n_total[active], level)
+            upper = _upper_bound(n_top[active], n_total[active], level)
+            active = active[(lower < threshold) & (upper >= threshold)]
+        
+        p_lower = _lower_bound(n_top, n_total, level)
+        certified = p_lower > .5
+        radii = np.where(certified, self.sigma * norm.ppf(np.maximum(p_lower, .5)), 0)
+        predictions = torch.where(torch.as_tensor(certified, device=x.device), c_hat, -1)
+        return predictions, torch.as_tensor(radii, dtype=torch.float, device=x.device)
+    
+    def predict(self, x: torch.Tensor, n: int, alpha: float = .001) -> torch.Tensor:
+        """
+        Predict with the PREDICT procedure of :cite:`cohen2019certified`, which abstains unless a binomial test
+        indicates that the top class is the prediction of the smoothed model with probability at least :math:`1 - \\alpha`.
+
+        Parameters
+        -----------
+        x
+            Input tensor.
+        
+        n
+            Number of noise draws.
+        
+        alpha
+            Probability of returning a class other than the one of the smoothed model.
+        
+        Returns
+        --------
+        torch.Tensor
+            Predicted classes, which are -1 for abstentions.
+        """
+        top = torch.topk(self.counts(x, n), 2, dim=1)
+        n_a, n_b = top.values.cpu().numpy().T
+        p_values = np.minimum(2 * binom.sf(n_a - 1, n_a + n_b, .5), 1)
+        abstain = torch.as_tensor(p_values > alpha, device=x.device)
+        return torch.where(abstain, -1, top.indices[:, 0])
+    
+    def _noisy_chunks(self, x: torch.Tensor, n: int) -> Iterator[Tuple[torch.Tensor, int]]:
+        """
+        Generate chunks of noisy copies of the batch, stacked along the batch dimension, with the number of draws in each chunk.
+        """
+        bs = x.shape[0]
+        max_draws = max(1, (self.max_batch_size or bs) // bs)
+        for start in range(0, n, max_draws):
+            draws = min(max_draws, n - start)
+            x_rep = x.repeat(draws, *[1] * (x.ndim - 1))
+            yield x_rep + self.sigma * torch.randn_like(x_rep), draws
+    
+    def parameters(self) -> Iterable:
+        return self.model.parameters()
+    
+    def modules(self) -> Iterable[torch.nn.Module]:
+        return self.model.modules()
+    
+    @property
+    def training(self) -> bool:
+        return getattr(self.model, 'training', False)
+    
+    def train(self, mode: bool = True) -> Model:
+        self.model.train(mode)
+        return self
+
+class _SmoothedSurrogate(Model):
+    """
+    Soft smoothed classifier that averages class probabilities over noise draws.
+    """
+    def __init__(self, smoothed: SmoothedModel):
+        super().__init__()
+        self.smoothed = smoothed
+    
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        draws = self.smoothed.eot_samples
+        x_rep = x.repeat(draws, *[1] * (x.ndim - 1))
+        y_logs = F.log_softmax(self.smoothed.model(x_rep + self.smoothed.sigma * torch.randn_like(x_rep)), dim=1)
+        # average the probabilities in log space, which stays finite when they underflow
+        return torch.logsumexp(y_logs.view(draws, x.shape[0], -1), dim=0) - math.log(draws)
+    
+    def parameters(self) -> Iterable:
+        return self.smoothed.parameters()
+    
+    def modules(self) -> Iterable[torch.nn.Module]:
+        return self.smoothed.modules()
+    
+    @property
+    def training(self) -> bool:
+        return self.smoothed.training
+    
+    def train(self, mode: bool = True) -> Model:
+        self.smoothed.train(mode)
+        return self
 
 class RandomizedSmoothing(Defense):
     """
@@ -58,17 +263,25 @@ class RandomizedSmoothing(Defense):
     
     n_classes
         Number of classes.
+    
+    max_batch_size
+        Maximum number of noisy samples passed through the model at once.
+    
+    eot_samples
+        Number of noise draws of the differentiable surrogate used by gradient-based attacks.
     """
 
-    def __init__(self, n_samples: int, sigma: float, n_classes: int):
+    def __init__(self, n_samples: int, sigma: float, n_classes: int, max_batch_size: int | None = None, eot_samples: int = 1):
         super().__init__()
 
         self.n_samples = n_samples
         self.sigma = sigma
         self.n_classes = n_classes
+        self.max_batch_size = max_batch_size
+        self.eot_samples = eot_samples
 
     def apply(self, model: Model) -> Model:
-        return SmoothedModel(model, self.n_samples, self.sigma, self.n_classes)
+        return SmoothedModel(model, self.n_samples, self.sigma, self.n_classes, self.max_batch_size, self.eot_samples)
 
 
 class DenoisedSmoothing(RandomizedSmoothing):
@@ -88,12 +301,32 @@ class DenoisedSmoothing(RandomizedSmoothing):
     
     n_classes
         Number of classes.
+    
+    max_batch_size
+        Maximum number of noisy samples passed through the model at once.
+    
+    eot_samples
+        Number of noise draws of the differentiable surrogate used by gradient-based attacks.
     """
 
-    def __init__(self, denoiser: Model, n_samples: int, sigma: float, n_classes: int):
-        super().__init__(n_samples, sigma, n_classes)
+    def __init__(self, denoiser: Model, n_samples: int, sigma: float, n_classes: int, max_batch_size: int | None = None, eot_samples: int = 1):
+        super().__init__(n_samples, sigma, n_classes, max_batch_size, eot_samples)
 
         self.denoiser = denoiser
 
     def apply(self, model: Model) -> Model:
-        return SmoothedModel(CompositeModel([self.denoiser, model]), self.n_samples, self.sigma, self.n_classes)
+        return SmoothedModel(CompositeModel([self.denoiser, model]), self.n_samples, self.sigma, self.n_classes, self.max_batch_size, self.eot_samples)
+
+def _lower_bound(k: np.ndarray, n: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    One-sided Clopper-Pearson lower confidence bound on a binomial proportion.
+    """
+    with np.errstate(invalid='ignore'):
+        return np.where(k > 0, beta.ppf(alpha, k, n - k + 1), 0.)
+
+def _upper_bound(k: np.ndarray, n: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    One-sided Clopper-Pearson upper confidence bound on a binomial proportion.
+    """
+    with np.errstate(invalid='ignore'):
+        return np.where(k < n, beta.ppf(1 - alpha, k + 1, n - k), 1.)
@@ -0,0 +1,92 @@
+"""
+Execution policies determine how models are run for inference in benchmarks and metrics.
+
+By default, inference runs under :code:`torch.inference_mode()` so that no autograd graphs are built.
+This keeps the measured runtime and peak memory consumption representative of a deployed model.
+Optionally, the inputs and models can be converted to the :code:`channels_last` memory format
+and inference can run under CPU bfloat16 autocast.
+"""
+import torch
+
+import contextlib
+
+from robusthub.models import Model
+
+class ExecutionPolicy:
+    """
+    Policy for running models during inference.
+    
+    Parameters
+    -----------
+    inference_mode
+        Run inference under :code:`torch.inference_mode()`.
+    
+    channels_last
+        Use the :code:`channels_last` memory format for models and four-dimensional inputs.
+    
+    bfloat16
+        Run inference under CPU bfloat16 autocast. Outputs are converted back to single precision.
+    """
+    def __init__(self, inference_mode: bool = True, channels_last: bool = False, bfloat16: bool = False):
+        self.inference_mode = inference_mode
+        self.channels_last = channels_last
+        self.bfloat16 = bfloat16
+    
+    def prepare(self, model: Model) -> Model:
+        """
+        Prepare a model for execution under this policy.
+        
+        Parameters
+        -----------
+        model
+            The model to prepare.
+        
+        Returns
+        --------
+        Model
+            The prepared model.
+        """
+        if self.channels_last and isinstance(model, torch.nn.Module):
+            model = model.to(memory_format=torch.channels_last)
+        return model
+    
+    @contextlib.contextmanager
+    def context(self):
+        """
+        Context manager in which inference runs according to this policy.
+        """
+        with contextlib.ExitStack() as stack:
+            if self.inference_mode:
+                stack.enter_context(torch.inference_mode())
+            if self.bfloat16:
+                stack.enter_context(torch.autocast('cpu', dtype=torch.bfloat16))
+            yield
+    
+    def __call__(self, model: Model, x: torch.Tensor) -> torch.Tensor:
+        """
+        Run inference with a model.
+        
+        Parameters
+        -----------
+        model
+            The model to run.
+        
+        x
+            Input tensor.
+        
+        Returns
+        --------
+        torch.Tensor
+            Output tensor.
+        """
+        if self.channels_last and x.ndim == 4:
+            x = x.contiguous(memory_format=torch.channels_last)
+        with self.context():
+            y = model(x)
+        if y.dtype == torch.bfloat16:
+            y = y.float()
+        # channels last outputs of image-to-image models are returned in the standard layout
+        return y.contiguous()
+    
+    def __repr__(self) -> str:
+        return f"ExecutionPolicy(inference_mode={self.inference_mode}, channels_last={self.channels_last}, bfloat16={self.bfloat16})"
@@ -3,6 +3,16 @@ Catalog of task-specific metrics.
 
 A metric is a real-valued summary statistic computed from a model and a batch of data. Note that these are not necessarily metrics in the mathematical sense.
 
+Metrics are defined in terms of the model predictions through :py:meth:`robusthub.metrics.Metric.score`,
+so that a single forward pass can be shared among any number of metrics.
+The :py:meth:`robusthub.metrics.Metric.compute` adapter runs the model itself and can be used when the predictions are not available.
+
+To evaluate a metric over an entire data set, benchmarks use *accumulators* obtained from :py:meth:`robusthub.metrics.Metric.accumulator`.
+An accumulator is updated batch by batch using constant memory and yields the data set level value of the metric,
+weighted by the number of samples in each batch. Accumulators can be merged, e.g. to combine results computed over different shards of the data.
+Their state stays on the device of the predictions and is only reduced to Python floats when :py:meth:`robusthub.metrics.Accumulator.result` is called,
+so that accumulating a batch does not synchronize with the host.
+
 We refer to these metrics as *task-specific* because their relevance depends on the particular task that the target model needs to solve.
 For instance, :py:class:`robusthub.metrics.Accuracy` is only applicable to classification tasks,
 whereas :py:class:`robusthub.metrics.MSE` is only applicable to regression problems.
@@ -12,21 +22,343 @@ Task-agnostic metrics are built into all benchmarks. Consult our :doc:`Benchmark
 """
 
 import torch
+import torch.nn.functional as F
 
 import numpy as np
 
 from abc import ABC, abstractmethod
 
+from typing import Callable, Tuple
+
 from robusthub.models import Model
+from robusthub.execution import ExecutionPolicy
+
+class _Moments:
+    """
+    Running weighted mean and variance, updated with the parallel variant of Welford's algorithm.
+
+    The state is kept in tensors on the device of the data, so updates do not synchronize with the host.
+    """
+    def __init__(self):
+        self.weight = 0.
+        self.weight_sq = 0.
+        self.mean = 0.
+        self.m2 = 0.
+    
+    def update(self, values: torch.Tensor, weights: torch.Tensor | None = None):
+        values = values.detach().double().flatten()
+        if weights is None:
+            weights = torch.ones_like(values)
+        weights = weights.to(values)
+        
+        weight = weights.sum()
+        mean = (weights * values).sum() / _nonzero(weight)
+        m2 = (weights * torch.square(values - mean)).sum()
+        self._combine(weight, torch.square(weights).sum(), mean, m2)
+    
+    def merge(self, other: '_Moments'):
+        self._combine(other.weight, other.weight_sq, other.mean, other.m2)
+    
+    def _combine(self, weight: torch.Tensor, weight_sq: torch.Tensor, mean: torch.Tensor, m2: torch.Tensor):
+        total = self.weight + weight
+        ratio = weight / _nonzero(total)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * ratio
+        self.m2 = self.m2 + m2 + delta**2 * self.weight * ratio
+        self.weight = total
+        self.weight_sq = self.weight_sq + weight_sq
+    
+    def value(self) -> float:
+        """
+        Weighted mean.
+        """
+        return float(self.mean)
+    
+    def err(self) -> float:
+        """
+        Half-width of the 95% confidence interval of the mean, based on the effective sample size.
+        """
+        weight = float(self.weight)
+        if weight == 0:
+            return 0.
+        variance = float(self.m2) / weight
+        n_eff = weight**2 / float(self.weight_sq)
+        return 1.96 * np.sqrt(variance / n_eff)
 
-from skimage.metrics import structural_similarity, peak_signal_noise_ratio
+def _nonzero(x: torch.Tensor | float) -> torch.Tensor:
+    x = torch.as_tensor(x, dtype=torch.float64)
+    return torch.clamp(x, min=torch.finfo(x.dtype).tiny)
 
-from sklearn.metrics import f1_score, roc_auc_score, roc_curve, matthews_corrcoef
+def _batch_weight(y_data: torch.Tensor) -> torch.Tensor:
+    # created on the device of the data, since copying it there would synchronize with the host
+    return torch.full((1,), y_data.shape[0], dtype=torch.float64, device=y_data.device)
+
+class Accumulator(ABC):
+    """
+    Abstract base class for streaming aggregates of a metric over a data set.
+    """
+    
+    @abstractmethod
+    def update(self, y_pred: torch.Tensor, y_data: torch.Tensor):
+        """
+        Add a batch of predictions to the aggregate.
+        
+        Parameters
+        -----------
+        y_pred
+            Model predictions.
+        
+        y_data
+            Ground truth.
+        """
+        pass
+    
+    @abstractmethod
+    def merge(self, other: 'Accumulator') -> 'Accumulator':
+        """
+        Merge another accumulator of the same metric into this one.
+        
+        Parameters
+        -----------
+        other
+            Accumulator to merge.
+        
+        Returns
+        --------
+        Accumulator
+            This accumulator.
+        """
+        pass
+    
+    @abstractmethod
+    def result(self) -> Tuple[float, float]:
+        """
+        Compute the aggregate value.
+        
+        Returns
+        --------
+        Tuple[float, float]
+            The value of the metric over all data seen so far and the half-width of its 95% confidence interval.
+        """
+        pass
+
+class BatchMean(Accumulator):
+    """
+    Mean of per-batch scores weighted by the batch size.
+    
+    This is the fallback for metrics that do not decompose over samples.
+    Scores returned as tensors are accumulated without synchronizing with the host.
+    
+    Parameters
+    -----------
+    score
+        Function computing the score of a batch.
+    """
+    def __init__(self, score: Callable[[torch.Tensor, torch.Tensor], float | torch.Tensor]):
+        self.score = score
+        self.moments = _Moments()
+    
+    def update(self, y_pred: torch.Tensor, y_data: torch.Tensor):
+        self.moments.update(torch.as_tensor(self.score(y_pred, y_data)).view(1),
+                            _batch_weight(y_data))
+    
+    def merge(self, other: 'BatchMean') -> 'BatchMean':
+        self.moments.merge(other.moments)
+        return self
+    
+    def result(self) -> Tuple[float, float]:
+        return self.moments.value(), self.moments.err()
+
+class SampleMean(Accumulator):
+    """
+    Mean of per-sample values.
+    
+    Parameters
+    -----------
+    samples
+        Function computing the metric value of each sample in a batch.
+    """
+    def __init__(self, samples: Callable[[torch.Tensor, torch.Tensor], torch.Tensor]):
+        self.samples = samples
+        self.moments = _Moments()
+    
+    def update(self, y_pred: torch.Tensor, y_data: torch.Tensor):
+        self.moments.update(self.samples(y_pred, y_data))
+    
+    def merge(self, other: 'SampleMean') -> 'SampleMean':
+        self.moments.merge(other.moments)
+        return self
+    
+    def result(self) -> Tuple[float, float]:
+        return self.moments.value(), self.moments.err()
+
+class ConfusionMatrix(Accumulator):
+    """
+    Confusion matrix of a classifier, from which the metric is computed.
+    
+    The error is estimated from the size-weighted variance of the per-batch scores.
+    
+    Parameters
+    -----------
+    score
+        Function computing the metric from a confusion matrix.
+    """
+    def __init__(self, score: Callable[[torch.Tensor], torch.Tensor]):
+        self.score = score
+        self.counts = None
+        self.moments = _Moments()
+    
+    def update(self, y_pred: torch.Tensor, y_data: torch.Tensor):
+        counts = _confusion(y_pred, y_data)
+        self.counts = counts if self.counts is None else self.counts + counts
+        self.moments.update(self.score(counts).view(1),
+                            _batch_weight(y_data))
+    
+    def merge(self, other: 'ConfusionMatrix') -> 'ConfusionMatrix':
+        if other.counts is not None:
+            self.counts = other.counts.clone() if self.counts is None else self.counts + other.counts.to(self.counts.device)
+        self.moments.merge(other.moments)
+        return self
+    
+    def result(self) -> Tuple[float, float]:
+        if self.counts is None:
+            return 0., 0.
+        return self.score(self.counts).item(), self.moments.err()
+
+class Ratio(Accumulator):
+    """
+    Ratio of two sums over all samples.
+    
+    The error is estimated from the size-weighted variance of the per-batch ratios.
+    
+    Parameters
+    -----------
+    terms
+        Function computing the numerator and denominator terms of each sample in a batch.
+    """
+    def __init__(self, terms: Callable[[torch.Tensor, torch.Tensor], Tuple[torch.Tensor, torch.Tensor]]):
+        self.terms = terms
+        self.numerator = 0.
+        self.denominator = 0.
+        self.moments = _Moments()
+    
+    def update(self, y_pred: torch.Tensor, y_data: torch.Tensor):
+        numerator, denominator = self.terms(y_pred, y_data)
+        numerator, denominator = numerator.detach().double().sum(), denominator.double().sum()
+        self.numerator = self.numerator + numerator
+        self.denominator = self.denominator + denominator
+        self.moments.update((numerator / denominator).view(1),
+                            _batch_weight(y_data))
+    
+    def merge(self, other: 'Ratio') -> 'Ratio':
+        self.numerator += other.numerator
+        self.denominator += other.denominator
+        self.moments.merge(other.moments)
+        return self
+    
+    def result(self) -> Tuple[float, float]:
+        denominator = float(self.denominator)
+        if denominator == 0:
+            return 0., 0.
+        return float(self.numerator) / denominator, self.moments.err()
+
+class ROCHistogram(Accumulator):
+    """
+    Histograms of the scores of the negative and positive samples of a binary classifier, from which the metric is computed.
+    
+    The histograms have a fixed number of bins and are kept on the device of the predictions.
+    
+    Parameters
+    -----------
+    scores
+        Function mapping the model predictions to scores in :math:`[0, 1]`.
+    
+    result
+        Function computing the metric and its error from the histograms.
+    
+    bins
+        Number of bins of the histograms.
+    """
+    def __init__(self,
+                 scores: Callable[[torch.Tensor], torch.Tensor],
+                 result: Callable[[torch.Tensor], Tuple[float, float]],
+                 bins: int):
+        self.scores = scores
+        self.from_histogram = result
+        self.bins = bins
+        self.counts = None
+    
+    def update(self, y_pred: torch.Tensor, y_data: torch.Tensor):
+        counts = _histogram(self.scores(y_pred), y_data, self.bins)
+        self.counts = counts if self.counts is None else self.counts + counts
+    
+    def merge(self, other: 'ROCHistogram') -> 'ROCHistogram':
+        if other.counts is not None:
+            self.counts = other.counts.clone() if self.counts is None else self.counts + other.counts.to(self.counts.device)
+        return self
+    
+    def result(self) -> Tuple[float, float]:
+        if self.counts is None:
+            return np.nan, 0.
+        return self.from_histogram(self.counts)
+
+def _confusion(y_pred: torch.Tensor, y_data: torch.Tensor) -> torch.Tensor:
+    n_classes = y_pred.shape[1]
+    labels = y_pred.argmax(dim=1)
+    return _count(y_data.long().view(-1) * n_classes + labels, n_classes**2).view(n_classes, n_classes)
+
+def _histogram(scores: torch.Tensor, y_data: torch.Tensor, bins: int) -> torch.Tensor:
+    idx = torch.clamp((scores.detach() * bins).long(), 0, bins - 1)
+    return _count(y_data.long().view(-1) * bins + idx, 2 * bins).view(2, bins)
+
+def _count(idx: torch.Tensor, size: int) -> torch.Tensor:
+    # unlike torch.bincount, the output size is known in advance, so counting does not synchronize with the host
+    counts = torch.zeros(size, dtype=torch.long, device=idx.device)
+    return counts.index_add_(0, idx, torch.ones_like(idx))
+
+def _binary_scores(y_pred: torch.Tensor, logits: bool) -> torch.Tensor:
+    if y_pred.ndim == 2 and y_pred.shape[1] == 2:
+        return torch.softmax(y_pred, dim=1)[:, 1]
+    y_pred = y_pred.view(-1)
+    return torch.sigmoid(y_pred) if logits else y_pred
+
+def _data_range(y_data: torch.Tensor, data_range: float | None) -> torch.Tensor | float:
+    if data_range is not None:
+        return data_range
+    flat = y_data.reshape(y_data.shape[0], -1)
+    return (flat.amax(dim=1) - flat.amin(dim=1)).view(-1, *[1] * (y_data.ndim - 1))
+
+def _psnr(y_pred: torch.Tensor, y_data: torch.Tensor, data_range: float | None) -> torch.Tensor:
+    r = _data_range(y_data, data_range)
+    mse = torch.square(y_pred - y_data).reshape(y_data.shape[0], -1).mean(dim=1)
+    return 10 * torch.log10(torch.square(torch.as_tensor(r).to(mse)).view(-1) / mse)
+
+def _ssim(y_pred: torch.Tensor, y_data: torch.Tensor, data_range: float | None, win_size: int) -> torch.Tensor:
+    if y_data.ndim == 3:
+        y_pred, y_data = y_pred.unsqueeze(1), y_data.unsqueeze(1)
+    r = _data_range(y_data, data_range)
+    c1 = (.01 * r)**2
+    c2 = (.03 * r)**2
+    
+    # local statistics over the valid part of the images, using the sample covariance
+    cov_norm = win_size**2 / (win_size**2 - 1)
+    ux = F.avg_pool2d(y_pred, win_size, stride=1)
+    uy = F.avg_pool2d(y_data, win_size, stride=1)
+    vx = cov_norm * (F.avg_pool2d(y_pred * y_pred, win_size, stride=1) - ux * ux)
+    vy = cov_norm * (F.avg_pool2d(y_data * y_data, win_size, stride=1) - uy * uy)
+    vxy = cov_norm * (F.avg_pool2d(y_pred * y_data, win_size, stride=1) - ux * uy)
+    
+    s = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux**2 + uy**2 + c1) * (vx + vy + c2))
+    return s.reshape(s.shape[0], -1).mean(dim=1)
 
 class Metric(ABC):
     """
     Abstract base class for all metrics.
 
+    Metrics should implement :py:meth:`score`, which allows benchmarks to share model predictions among metrics.
+    Metrics that only implement :py:meth:`compute` are still supported, in which case benchmarks call it on every batch
+    and average the results weighted by batch size.
+    
     Parameters
     -----------
     name
@@ -38,18 +370,70 @@ class Metric(ABC):
     def __init__(self, name: str, bounds: tuple[float, float]):
         self.name = name
         self.bounds = bounds
-
-    @abstractmethod
-    def compute(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> float:
+    
+    def score(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> float:
         """
-        Compute the metric value.
-
+        Compute the metric value from precomputed model predictions.
+        
+        Parameters
+        -----------
+        y_pred
+            Model predictions.
+        
+        y_data
+            Ground truth.
+        
         Returns
         --------
         float
             Metric value.
         """
-        pass
+        raise NotImplementedError(f'{self.name} can only be computed by running a model, see compute')
+    
+    def compute(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor, policy: ExecutionPolicy | None = None) -> float:
+        """
+        Compute the metric value by running the model on the given data.
+        
+        Parameters
+        -----------
+        model
+            Model to evaluate.
+        
+        x_data
+            Input data.
+        
+        y_data
+            Ground truth.
+        
+        policy
+            Execution policy for running the model. By default, the model is called directly.
+        
+        Returns
+        --------
+        float
+            Metric value.
+        """
+        y_pred = policy(model, x_data) if policy is not None else model(x_data)
+        return self.score(y_pred, y_data)
+    
+    def accumulator(self) -> Accumulator:
+        """
+        Create an accumulator to evaluate this metric over a data set.
+        
+        By default, this is the batch size weighted mean of the per-batch scores.
+        
+        Returns
+        --------
+        Accumulator
+            A new, empty accumulator.
+        """
+        return BatchMean(self.score)
+
+def _scores(metric: Metric) -> bool:
+    """
+    Whether a metric can be computed from precomputed predictions.
+    """
+    return type(metric).score is not Metric.score
 
 class Accuracy(Metric):
     """
@@ -58,9 +442,14 @@ class Accuracy(Metric):
     def __init__(self):
         super().__init__('Accuracy', (0, 1))
     
-    def compute(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> float:
-        y_pred = model(x_data)
-        return torch.mean((y_pred.argmax(dim=1) == y_data).float()).item()
+    def score(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> float:
+        return self.from_confusion(_confusion(y_pred, y_data)).item()
+    
+    def from_confusion(self, counts: torch.Tensor) -> torch.Tensor:
+        return counts.trace().double() / counts.sum()
+    
+    def accumulator(self) -> Accumulator:
+        return ConfusionMatrix(self.from_confusion)
 
 class MSE(Metric):
     """
@@ -69,9 +458,14 @@ class MSE(Metric):
     def __init__(self):
         super().__init__('MSE', (0, np.inf))
     
-    def compute(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> float:
-        y_pred = model(x_data)
-        return torch.mean(torch.square(y_pred - y_data)).item()
+    def score(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> float:
+        return torch.mean(self.samples(y_pred, y_data)).item()
+    
+    def samples(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> torch.Tensor:
+        return torch.square(y_pred - y_data).reshape(y_data.shape[0], -1).mean(dim=1)
+    
+    def accumulator(self) -> Accumulator:
+        return SampleMean(self.samples)
 
 class NMSE(Metric):
     """
@@ -80,10 +474,15 @@ class NMSE(Metric):
     def __init__(self):
         super().__init__('NMSE', (0, np.inf))
     
-    def compute(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> float:
-        y_pred = model(x_data)
-        mse = torch.mean(torch.square(y_pred - y_data))
-        return mse / torch.mean(torch.square(y_data))
+    def score(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> float:
+        numerator, denominator = self.terms(y_pred, y_data)
+        return (numerator.sum() / denominator.sum()).item()
+    
+    def terms(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        return torch.square(y_pred - y_data), torch.square(y_data)
+    
+    def accumulator(self) -> Accumulator:
+        return Ratio(self.terms)
 
 class MAE(Metric):
     """
@@ -92,83 +491,182 @@ class MAE(Metric):
     def __init__(self):
         super().__init__('MAE', (0, np.inf))
     
-    def compute(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> float:
-        y_pred = model(x_data)
-        return torch.mean(torch.square(y_pred - y_data)).item()
+    def score(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> float:
+        return torch.mean(self.samples(y_pred, y_data)).item()
+    
+    def samples(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> torch.Tensor:
+        return torch.abs(y_pred - y_data).reshape(y_data.shape[0], -1).mean(dim=1)
+    
+    def accumulator(self) -> Accumulator:
+        return SampleMean(self.samples)
 
 class SSIM(Metric):
     """
-    The structural similarity index measure.
+    The structural similarity index measure :cite:`wang2004image`.
+    
+    The SSIM is computed for every image separately with a uniform window and averaged over all channels.
+    Images are expected to be batches of shape :code:`(N, C, H, W)` or :code:`(N, H, W)`.
+    
+    Parameters
+    -----------
+    data_range
+        Data range of the images. By default, the range of values of each ground truth image is used.
+    
+    win_size
+        Side length of the window.
     """
-    def __init__(self):
+    def __init__(self, data_range: float | None = None, win_size: int = 3):
         super().__init__('SSIM', (0, 1))
+        self.data_range = data_range
+        self.win_size = win_size
     
-    def compute(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> float:
-        y_pred = model(x_data)
-        r = x_data.max() - x_data.min()
-
-        im1 = y_data.cpu().detach().numpy()
-        im2 = y_pred.cpu().detach().numpy()
-        return structural_similarity(im1, im2, data_range=r.item(), win_size=3)
+    def score(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> float:
+        return torch.mean(self.samples(y_pred, y_data)).item()
+    
+    def samples(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> torch.Tensor:
+        return _ssim(y_pred.detach(), y_data, self.data_range, self.win_size)
+    
+    def accumulator(self) -> Accumulator:
+        return SampleMean(self.samples)
 
 class PSNR(Metric):
     """
-    The peak signal-to-noise ratio.
+    The peak signal-to-noise ratio, computed for every image separately.
+    
+    Parameters
+    -----------
+    data_range
+        Data range of the images. By default, the range of values of each ground truth image is used.
     """
-    def __init__(self):
+    def __init__(self, data_range: float | None = None):
         super().__init__('PSNR', (0, np.inf))
+        self.data_range = data_range
+    
+    def score(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> float:
+        return torch.mean(self.samples(y_pred, y_data)).item()
+    
+    def samples(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> torch.Tensor:
+        return _psnr(y_pred.detach(), y_data, self.data_range)
     
-    def compute(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> float:
-        y_pred = model(x_data)
-        r = x_data.max() - x_data.min()
-        return peak_signal_noise_ratio(y_data.cpu().detach().numpy(),
-                                       y_pred.cpu().detach().numpy(),
-                                       data_range=r.item())
+    def accumulator(self) -> Accumulator:
+        return SampleMean(self.samples)
 
 class F1(Metric):
     """
-    The F1 score.
+    The F1 score of a binary classifier, where class 1 is the positive class.
     """
     def __init__(self):
         super().__init__('F1', (0, 1))
     
-    def compute(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> float:
-        y_pred = model(x_data)
-        labels = y_pred.argmax(dim=1).cpu().detach().numpy()
-        return f1_score(y_data.cpu().detach().numpy(), labels)
+    def score(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> float:
+        return self.from_confusion(_confusion(y_pred, y_data)).item()
+    
+    def from_confusion(self, counts: torch.Tensor) -> torch.Tensor:
+        counts = counts.double()
+        tp = counts[1, 1]
+        fp = counts[:, 1].sum() - tp
+        fn = counts[1, :].sum() - tp
+        return 2 * tp / torch.clamp(2 * tp + fp + fn, min=1)
+    
+    def accumulator(self) -> Accumulator:
+        return ConfusionMatrix(self.from_confusion)
 
 class AUC(Metric):
     """
-    The AUC score.
+    The area under the ROC curve of a binary classifier.
+    
+    The ROC curve is estimated from fixed-size histograms of the scores of either class,
+    so the metric is computed over the entire data set in constant memory.
+    The error is estimated following :cite:`hanley1982meaning`.
+    
+    The scores are the predicted probabilities of the positive class. If the model outputs two columns,
+    these are converted to probabilities using a softmax. A single column is interpreted as a probability
+    or, if :code:`logits` is set, as a logit.
+    
+    Parameters
+    -----------
+    bins
+        Number of histogram bins.
+    
+    logits
+        The model outputs a single logit rather than a probability.
     """
-    def __init__(self):
+    def __init__(self, bins: int = 1000, logits: bool = False):
         super().__init__('AUC', (0, 1))
+        self.bins = bins
+        self.logits = logits
+    
+    def score(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> float:
+        return self.from_histogram(_histogram(self.scores(y_pred), y_data, self.bins))[0]
+    
+    def scores(self, y_pred: torch.Tensor) -> torch.Tensor:
+        return _binary_scores(y_pred, self.logits)
     
-    def compute(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> float:
-        y_pred = model(x_data)
-        return roc_auc_score(y_data.cpu().detach().numpy(), y_pred.cpu().detach().numpy())
+    def from_histogram(self, counts: torch.Tensor) -> Tuple[float, float]:
+        counts = counts.double()
+        negatives, positives = counts[0], counts[1]
+        n_neg, n_pos = negatives.sum().item(), positives.sum().item()
+        if n_neg == 0 or n_pos == 0:
+            return np.nan, 0.
+        
+        # ties within a bin count for half
+        below = torch.cumsum(negatives, dim=0) - negatives
+        auc = (torch.sum(positives * (below + negatives / 2)) / (n_neg * n_pos)).item()
+        
+        q1 = auc / (2 - auc)
+        q2 = 2 * auc**2 / (1 + auc)
+        variance = (auc * (1 - auc) + (n_pos - 1) * (q1 - auc**2) + (n_neg - 1) * (q2 - auc**2)) / (n_pos * n_neg)
+        return auc, 1.96 * np.sqrt(max(variance, 0))
+    
+    def accumulator(self) -> Accumulator:
+        return ROCHistogram(self.scores, self.from_histogram, self.bins)
 
 class TPR(Metric):
     """
     The true positive rate at a given false positive rate threshold.
-
+    
+    The ROC curve is estimated in the same way as for :py:class:`robusthub.metrics.AUC`.
+    
     Parameters
     -----------
     fpr
         The maximum false positive rate.
+    
+    bins
+        Number of histogram bins.
+    
+    logits
+        The model outputs a single logit rather than a probability.
     """
-    def __init__(self, fpr=.1):
+    def __init__(self, fpr=.1, bins: int = 1000, logits: bool = False):
         super().__init__(f'TPR({fpr:.2%})', (0, 1))
         self.fpr = fpr
-
+        self.bins = bins
+        self.logits = logits
+        
         assert 0 <= fpr <= 1, 'FPR must be between 0 and 1'
     
-    def compute(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> float:
-        y_pred = model(x_data)
-        fpr, tpr, _ = roc_curve(y_data.cpu().detach().numpy(), y_pred.cpu().detach().numpy())
-
-        idx = max(0, np.searchsorted(fpr, self.fpr, side='right') - 1)
-        return tpr[idx]
+    def score(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> float:
+        return self.from_histogram(_histogram(self.scores(y_pred), y_data, self.bins))[0]
+    
+    def scores(self, y_pred: torch.Tensor) -> torch.Tensor:
+        return _binary_scores(y_pred, self.logits)
+    
+    def from_histogram(self, counts: torch.Tensor) -> Tuple[float, float]:
+        counts = counts.double()
+        negatives, positives = counts[0], counts[1]
+        n_neg, n_pos = negatives.sum().item(), positives.sum().item()
+        if n_neg == 0 or n_pos == 0:
+            return np.nan, 0.
+        
+        # rates when thresholding at the lower edge of each bin, from the highest to the lowest threshold
+        fpr = torch.flip(torch.cumsum(torch.flip(negatives, [0]), dim=0), [0]) / n_neg
+        tpr = torch.flip(torch.cumsum(torch.flip(positives, [0]), dim=0), [0]) / n_pos
+        tpr = torch.max(torch.where(fpr <= self.fpr, tpr, torch.zeros_like(tpr))).item()
+        return tpr, 1.96 * np.sqrt(tpr * (1 - tpr) / n_pos)
+    
+    def accumulator(self) -> Accumulator:
+        return ROCHistogram(self.scores, self.from_histogram, self.bins)
 
 class MCC(Metric):
     """
@@ -176,7 +674,21 @@ class MCC(Metric):
     """
     def __init__(self):
         super().__init__('MCC', (-1, 1))
-
-    def compute(self, model: Model, x_data: torch.Tensor, y_data: torch.Tensor) -> float:
-        y_pred = model(x_data).cpu().detach().numpy().argmax(axis=1)
-        return matthews_corrcoef(y_data.cpu().detach().numpy(), y_pred)
+    
+    def score(self, y_pred: torch.Tensor, y_data: torch.Tensor) -> float:
+        return self.from_confusion(_confusion(y_pred, y_data)).item()
+    
+    def from_confusion(self, counts: torch.Tensor) -> torch.Tensor:
+        counts = counts.double()
+        t_sum = counts.sum(dim=1)
+        p_sum = counts.sum(dim=0)
+        n_correct = counts.trace()
+        n_samples = counts.sum()
+        cov_ytyp = n_correct * n_samples - torch.dot(t_sum, p_sum)
+        cov_ypyp = n_samples**2 - torch.dot(p_sum, p_sum)
+        cov_ytyt = n_samples**2 - torch.dot(t_sum, t_sum)
+        denominator = cov_ytyt * cov_ypyp
+        return torch.where(denominator > 0, cov_ytyp / torch.sqrt(_nonzero(denominator)), 0.)
+    
+    def accumulator(self) -> Accumulator:
+        return ConfusionMatrix(self.from_confusion)
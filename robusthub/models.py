@@ -6,7 +6,11 @@ RobustHub relies on PyTorch Hub for loading models externally. Consult the `PyTo
 
 import torch
 
-from typing import List, Iterable
+import itertools
+
+import contextlib
+
+from typing import List, Iterable, Iterator
 
 from abc import ABC, abstractmethod
 
@@ -44,6 +48,58 @@ class Model(ABC):
         """
         pass
 
+    def train(self, mode: bool = True) -> 'Model':
+        """
+        Set the model to training or evaluation mode. Models without such modes ignore this.
+
+        Parameters
+        -----------
+        mode
+            True for training mode, False for evaluation mode.
+        
+        Returns
+        --------
+        Model
+            This model.
+        """
+        return self
+
+    def modules(self) -> Iterable[torch.nn.Module]:
+        """
+        Return the PyTorch modules of the model, which allows saving and restoring the training mode of each of them.
+        Models without PyTorch modules return nothing.
+
+        Returns
+        --------
+        Iterable
+            Iterable of modules.
+        """
+        return iter(())
+
+    def eval(self) -> 'Model':
+        """
+        Set the model to evaluation mode.
+
+        Returns
+        --------
+        Model
+            This model.
+        """
+        return self.train(False)
+
+    def surrogate(self) -> 'Model':
+        """
+        Differentiable surrogate of this model, which gradient-based attacks use to compute gradients.
+        Models with non-differentiable or stochastic outputs can return a smooth approximation here.
+        By default, the model is its own surrogate.
+
+        Returns
+        --------
+        Model
+            The surrogate model.
+        """
+        return self
+
     def __call__(self, x: torch.Tensor) -> torch.Tensor:
         """
         Forward pass through the model.
@@ -78,6 +134,48 @@ class CompositeModel(Model):
         for model in self.models:
             y_out = model(y_out)
         return y_out
+    
+    def parameters(self) -> Iterable:
+        return itertools.chain.from_iterable(model.parameters() for model in self.models)
+    
+    def modules(self) -> Iterable[torch.nn.Module]:
+        return itertools.chain.from_iterable(model.modules() for model in self.models)
+    
+    @property
+    def training(self) -> bool:
+        return any(getattr(model, 'training', False) for model in self.models)
+    
+    def train(self, mode: bool = True) -> Model:
+        for model in self.models:
+            model.train(mode)
+        return self
+
+@contextlib.contextmanager
+def eval_mode(model: Model) -> Iterator[Model]:
+    """
+    Context manager that puts a model in evaluation mode.
+
+    The training mode of every module of the model is restored individually when the context is exited,
+    so modules that were deliberately kept in a different mode than the rest of the model stay that way.
+
+    Parameters
+    -----------
+    model
+        The model.
+    """
+    modules = list(model.modules()) if hasattr(model, 'modules') else []
+    modes = [module.training for module in modules]
+    training = getattr(model, 'training', False)
+
+    model.eval()
+    try:
+        yield model
+    finally:
+        if modules:
+            for module, mode in zip(modules, modes):
+                module.training = mode
+        else:
+            model.train(training)
 
 def load(repo: str, ident: str, **kwargs) -> Model:
     """
@@ -6,26 +6,46 @@ class Profiler:
     """
     Memory and runtime profiler used in benchmarks.
 
+    By default, every profiled section starts a new measurement.
+    A cumulative profiler instead adds up the runtime of all profiled sections and keeps the overall peak memory,
+    which allows profiling code that is interleaved with other work. Call :py:meth:`reset` to start over.
+
     Parameters
     -----------
     device
         PyTorch device to monitor.
+
+    cumulative
+        Accumulate measurements over all profiled sections.
     """
-    def __init__(self, device: torch.device):
+    def __init__(self, device: torch.device, cumulative: bool = False):
         self.device = device
+        self.cumulative = cumulative
 
         self.start_time_ = 0
-        self.end_time_ = 0
+        self.runtime_ = 0
+        self.memory = 0
+
+    def reset(self):
+        """
+        Discard all measurements.
+        """
+        self.runtime_ = 0
         self.memory = 0
 
     def __enter__(self):
+        if not self.cumulative:
+            self.reset()
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
         self.start_time_ = time.time()
-        torch.cuda.reset_peak_memory_stats(self.device)
-    
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.end_time_ = time.time()
-        self.memory = torch.cuda.max_memory_allocated(self.device)
-    
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            self.memory = max(self.memory, torch.cuda.max_memory_allocated(self.device))
+        self.runtime_ += time.time() - self.start_time_
+
     @property
     def runtime(self):
-        return self.end_time_ - self.start_time_
+        return self.runtime_
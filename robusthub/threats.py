@@ -10,9 +10,11 @@ import numpy as np
 
 import warnings
 
+import contextlib
+
 from abc import ABC, abstractmethod
 
-from typing import List
+from typing import Iterator, List, Tuple
 
 class ThreatModel(ABC):
     """
@@ -41,6 +43,22 @@ class ThreatModel(ABC):
         """
         pass
 
+    @contextlib.contextmanager
+    def bind(self, x_orig: torch.Tensor) -> Iterator['ThreatModel']:
+        """
+        Bind this threat model to a batch of original samples.
+
+        Attacks enter this context once per batch. Threat models can use it to validate the samples
+        and precompute everything that does not depend on the perturbations, so that :py:meth:`project`
+        reduces to pure tensor operations on the samples of the batch or subsets thereof.
+
+        Parameters
+        -----------
+        x_orig
+            Original samples.
+        """
+        yield self
+
     def __repr__(self) -> str:
         """
         String represenation of this threat model.
@@ -50,19 +68,79 @@ class ThreatModel(ABC):
 class Composite(ThreatModel):
     """
     Sequentially compose multiple threat models.
+
+    Compositions of :math:`L_\\infty` and :py:class:`Bounds` threat models are fused into a single clamp against
+    element-wise lower and upper bounds. Within :py:meth:`bind`, these bounds are computed once per batch of original samples.
+    If the composition additionally contains a single :math:`L_1` or :math:`L_2` threat model, the samples are projected
+    exactly onto the intersection with a batched bisection.
+    All other compositions are applied sequentially.
     """
     def __init__(self, threat_models: List[ThreatModel]):
         super().__init__()
         self.threats = threat_models
+
+        balls = [t for t in threat_models if not _is_box(t)]
+        self.ball = balls[0] if len(balls) == 1 and isinstance(balls[0], Lp) and balls[0].p in (1, 2) else None
+        self.fused = len(balls) == 0 or self.ball is not None
+
+        self.bound_ = False
+        self.x_orig_ = None
+        self.box_ = None
     
     def project(self, x_orig: torch.Tensor, x_tilde: torch.Tensor) -> torch.Tensor:
         """
         Apply all given threat models.
         """
+        if self.fused:
+            lower, upper = self._box(x_orig)
+            if self.ball is not None:
+                return _bisect(x_orig, x_tilde, self.ball.p, self.ball.epsilon, lower, upper)
+            return torch.clamp(x_tilde, lower, upper)
+
         x_proj = x_tilde
         for threat in self.threats:
             x_proj = threat.project(x_orig, x_proj)
         return x_proj
+
+    @contextlib.contextmanager
+    def bind(self, x_orig: torch.Tensor) -> Iterator['ThreatModel']:
+        """
+        Bind all given threat models and precompute the fused bounds.
+        Within this context, the fused bounds are cached for the most recent original samples. The cache is cleared on exit.
+        """
+        state = self.bound_, self.x_orig_, self.box_
+        with contextlib.ExitStack() as stack:
+            for threat in self.threats:
+                stack.enter_context(threat.bind(x_orig))
+            self.bound_ = True
+            try:
+                if self.fused:
+                    self._box(x_orig)
+                yield self
+            finally:
+                self.bound_, self.x_orig_, self.box_ = state
+    
+    def _box(self, x_orig: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Element-wise bounds of the fused threat models. When bound, they are cached for the most recent original samples.
+        """
+        if not self.bound_ or x_orig is not self.x_orig_:
+            lower = torch.full_like(x_orig, -np.inf)
+            upper = torch.full_like(x_orig, np.inf)
+            for threat in self.threats:
+                if isinstance(threat, Bounds):
+                    threat._check(x_orig)
+                    if threat.lower is not None:
+                        lower.clamp_(min=threat.lower)
+                    if threat.upper is not None:
+                        upper.clamp_(max=threat.upper)
+                elif _is_box(threat):
+                    torch.maximum(lower, x_orig - threat.epsilon, out=lower)
+                    torch.minimum(upper, x_orig + threat.epsilon, out=upper)
+            if not self.bound_:
+                return lower, upper
+            self.x_orig_, self.box_ = x_orig, (lower, upper)
+        return self.box_
     
     def __repr__(self) -> str:
         return "; ".join([str(t) for t in self.threats])
@@ -83,15 +161,33 @@ class Bounds(ThreatModel):
         super().__init__()
         self.lower = lower_bound
         self.upper = upper_bound
+        self.bound_ = False
     
     def project(self, x_orig: torch.Tensor, x_tilde: torch.Tensor) -> torch.Tensor:
         """
         Clip the values of the data to the specified range.
         """
-        if x_orig.min() < self.lower or x_orig.max() > self.upper:
-            warnings.warn(f'Threat model bounds ({self.lower}, {self.upper}) do not agree with data bounds ({x_orig.min()}, {x_orig.max()})')
+        self._check(x_orig)
         return torch.clamp(x_tilde, self.lower, self.upper)
     
+    @contextlib.contextmanager
+    def bind(self, x_orig: torch.Tensor) -> Iterator['ThreatModel']:
+        """
+        Check the data bounds once. Projections within this context skip the check.
+        """
+        self._check(x_orig)
+        bound, self.bound_ = self.bound_, True
+        try:
+            yield self
+        finally:
+            self.bound_ = bound
+    
+    def _check(self, x_orig: torch.Tensor):
+        if self.bound_:
+            return
+        if (self.lower is not None and x_orig.min() < self.lower) or (self.upper is not None and x_orig.max() > self.upper):
+            warnings.warn(f'Threat model bounds ({self.lower}, {self.upper}) do not agree with data bounds ({x_orig.min()}, {x_orig.max()})')
+    
     def __repr__(self) -> str:
         return f"Bounds({self.lower}, {self.upper})"
 
@@ -115,7 +211,16 @@ class Lp(ThreatModel):
     def project(self, x_orig: torch.Tensor, x_tilde: torch.Tensor) -> torch.Tensor:
         """
         Project the perturbed samples onto the given Lp norm ball.
+
+        For :math:`p = \\infty`, this is an exact element-wise clamp and for :math:`p = 1`, the exact sort-based projection of :cite:`duchi2008efficient`.
+        Otherwise, the perturbations are rescaled to the norm ball, which is exact for :math:`p = 2`.
         """
+        if np.isinf(self.p):
+            return torch.clamp(x_tilde, x_orig - self.epsilon, x_orig + self.epsilon)
+        if self.p == 1:
+            deltas = (x_tilde - x_orig).view(x_orig.shape[0], -1)
+            return x_orig + _project_l1(deltas, self.epsilon).view(x_orig.shape)
+
         deltas = (x_tilde - x_orig).view(x_orig.shape[0], -1)
         norms = torch.linalg.vector_norm(deltas, self.p, dim=1, keepdim=True)
 
@@ -135,9 +240,84 @@ class Linf(Lp):
     def __init__(self, epsilon: float):
         super().__init__(np.inf, epsilon)
 
+class L1(Lp):
+    """
+    :math:`L_1` threat model.
+    """
+    def __init__(self, epsilon: float):
+        super().__init__(1, epsilon)
+
 class L2(Lp):
     """
     :math:`L_2` threat model.
     """
     def __init__(self, epsilon: float):
         super().__init__(2, epsilon)
+
+def _is_box(threat: ThreatModel) -> bool:
+    return isinstance(threat, Bounds) or (isinstance(threat, Lp) and np.isinf(threat.p))
+
+def _project_l1(deltas: torch.Tensor, epsilon: float) -> torch.Tensor:
+    """
+    Project a batch of flat perturbations onto the L1 ball by sorting their magnitudes.
+    """
+    mu, _ = torch.sort(torch.abs(deltas), dim=1, descending=True)
+    cumsum = torch.cumsum(mu, dim=1)
+    ks = torch.arange(1, deltas.shape[1] + 1, dtype=deltas.dtype, device=deltas.device)
+    rho = torch.sum(mu * ks > cumsum - epsilon, dim=1, keepdim=True)
+    theta = torch.clamp((cumsum.gather(1, rho - 1) - epsilon) / rho, min=0)
+    return _soft_threshold(deltas, theta)
+
+def _soft_threshold(deltas: torch.Tensor, theta: torch.Tensor) -> torch.Tensor:
+    return torch.sign(deltas) * torch.clamp(torch.abs(deltas) - theta, min=0)
+
+def _bisect(x_orig: torch.Tensor,
+            x_tilde: torch.Tensor,
+            p: float,
+            epsilon: float,
+            lower: torch.Tensor,
+            upper: torch.Tensor,
+            steps: int = 32) -> torch.Tensor:
+    """
+    Exact projection onto the intersection of an L1 or L2 ball and element-wise bounds.
+
+    The problem is separable given the Lagrange multiplier of the norm constraint, whose solution is a clamped
+    scaling (L2) or soft thresholding (L1) of the perturbations. The multiplier is found per sample by bisection.
+    """
+    bs = x_orig.shape[0]
+    deltas = (x_tilde - x_orig).view(bs, -1)
+    x_flat, lower, upper = x_orig.view(bs, -1), lower.view(bs, -1), upper.view(bs, -1)
+    if p == 1:
+        theta_max = torch.amax(torch.abs(deltas), dim=1, keepdim=True)
+
+    def solve(t: torch.Tensor) -> torch.Tensor:
+        # the norm of the perturbations is increasing in t, with t = 1 the solution without the norm constraint
+        if p == 1:
+            return torch.clamp(x_flat + _soft_threshold(deltas, (1 - t) * theta_max), lower, upper)
+        return torch.clamp(x_flat + t * deltas, lower, upper)
+
+    def feasible(t: torch.Tensor) -> torch.Tensor:
+        return torch.linalg.vector_norm(solve(t) - x_flat, p, dim=1, keepdim=True) <= epsilon
+
+    t_low = torch.zeros(bs, 1, dtype=x_orig.dtype, device=x_orig.device)
+    t_high = torch.ones_like(t_low)
+    done = feasible(t_high)
+    for _ in range(steps):
+        t_mid = (t_low + t_high) / 2
+        ok = feasible(t_mid)
+        t_low = torch.where(ok, t_mid, t_low)
+        t_high = torch.where(ok, t_high, t_mid)
+    return solve(torch.where(done, t_high, t_low)).view(x_orig.shape)
+
+def _find_lp(threat: ThreatModel) -> Lp | None:
+    """
+    Find the first Lp threat model in a (possibly composite) threat model.
+    """
+    if isinstance(threat, Lp):
+        return threat
+    if isinstance(threat, Composite):
+        for t in threat.threats:
+            lp = _find_lp(t)
+            if lp is not None:
+                return lp
+    return None
@@ -26,3 +26,9 @@ def fgsm(**kwargs) -> Attack:
 
 def simba(**kwargs) -> Attack:
     return attacks.Simba(**kwargs)
+
+def cascade(**kwargs) -> Attack:
+    return attacks.Cascade(**kwargs)
+
+def minimal_perturbation(**kwargs) -> Attack:
+    return attacks.MinimalPerturbation(**kwargs)
\ No newline at end of file
@@ -1,6 +1,13 @@
+import pytest
+
+import torch
+
+import numpy as np
+
 from robusthub import threats
 from robusthub import models
 from robusthub import defenses
+from robusthub import attacks
 
 def test_at(trainloader, testloader, device):
     # load model
@@ -25,3 +32,46 @@ def test_at(trainloader, testloader, device):
         correct += (y_batch.cpu().detach().numpy() == y_pred.cpu().detach().numpy()).sum()
         total += x_batch.shape[0]
     print(f'Accuracy: {correct/total:.2%}')
+
+def _tiny_setup():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(12, 3))
+    dataset = torch.utils.data.TensorDataset(torch.rand(16, 3, 2, 2), torch.randint(0, 3, (16,)))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=8)
+    threat_model = threats.Composite([
+        threats.Linf(.1),
+        threats.Bounds(0, 1)])
+    return model, loader, threat_model
+
+def test_free_at():
+    model, loader, threat_model = _tiny_setup()
+    defense = defenses.AdversarialTraining(loader, loader, threat_model, nb_epochs=1, device=torch.device('cpu'), mode='free', replays=3)
+    assert isinstance(defense.attack, attacks.FastGradientSignMethod), 'Free mode does not validate with a cheap attack'
+
+    # replay a single minibatch and count the weight updates
+    optimizer = torch.optim.SGD(model.parameters(), lr=.1)
+    step, steps = optimizer.step, []
+    optimizer.step = lambda *args, **kwargs: steps.append(1) or step(*args, **kwargs)
+    params = [p.detach().clone() for p in model.parameters()]
+    x_data, y_data = next(iter(loader))
+    deltas = defense._replay(model, optimizer, x_data, y_data, None)
+
+    assert len(steps) == 3, 'Minibatch was not replayed the given number of times'
+    assert any(not torch.equal(p, q) for p, q in zip(params, model.parameters())), 'Parameters were not updated'
+    assert deltas.abs().max() <= .1 + 1e-6, 'Perturbations exceed the budget'
+    assert (x_data + deltas).min() >= 0 and (x_data + deltas).max() <= 1, 'Perturbed samples exceed the bounds'
+    assert deltas.abs().max() > 0, 'Perturbations were not updated'
+
+def test_fast_at():
+    model, loader, threat_model = _tiny_setup()
+    defense = defenses.AdversarialTraining(loader, loader, threat_model, nb_epochs=1, device=torch.device('cpu'), mode='fast')
+
+    assert isinstance(defense.attack, attacks.FastGradientSignMethod)
+    assert np.isclose(defense.attack.eps, 1.25 * .1) and np.isclose(defense.attack.sigma, .1)
+
+    # training changes the parameters of a copy of the model
+    at_model = defense.apply(model)
+    assert any(not torch.equal(p, q) for p, q in zip(model.parameters(), at_model.parameters())), 'Parameters were not updated'
+
+    with pytest.raises(ValueError):
+        defenses.AdversarialTraining(loader, loader, threats.Bounds(0, 1), device=torch.device('cpu'), mode='fast')
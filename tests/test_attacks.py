@@ -0,0 +1,181 @@
+import pytest
+
+import torch
+
+from robusthub import threats
+from robusthub import attacks
+from robusthub.attacks.attack import _restarts
+
+def test_compiled_step():
+    torch.manual_seed(0)
+    threat_model = threats.Composite([threats.Linf(.1), threats.Bounds(0, 1)])
+    attack = attacks.ProjectedGradientDescent(threat_model, alpha=.05, device=torch.device('cpu'), compiled=True)
+
+    # batches of different sizes, as with a shrinking active set
+    for bs in [4, 3]:
+        x_orig = torch.rand(bs, 3, 8, 8)
+        x_adv = threat_model.project(x_orig, x_orig + .1 * torch.randn_like(x_orig))
+        grad = torch.randn_like(x_orig)
+        assert torch.allclose(attack.step(x_adv, grad, x_orig), attack._step(x_adv, grad, x_orig)), 'Compiled step does not match eager step'
+
+    if not attack.step.enabled:
+        pytest.skip('torch.compile is not available')
+
+def _tiny_classifier():
+    # predicts the largest feature, so every sample can be fooled within the budget below
+    model = torch.nn.Sequential(torch.nn.Linear(3, 3), torch.nn.LogSoftmax(dim=1))
+    with torch.no_grad():
+        model[0].weight.copy_(torch.eye(3))
+        model[0].bias.zero_()
+    x_data = torch.rand(16, 3)
+    y_data = x_data.argmax(dim=1)
+    threat_model = threats.Composite([threats.Linf(.5), threats.Bounds(0, 1)])
+    return model, x_data, y_data, threat_model
+
+@pytest.mark.parametrize('attack_class', [attacks.ProjectedGradientDescent, attacks.AutoProjectedGradientDescent])
+@pytest.mark.parametrize('options', [
+    {},
+    {'batch_restarts': True},
+    {'batch_restarts': True, 'max_batch_size': 32},
+    {'early_stop': True},
+    {'tol': 1e-3},
+])
+def test_gradient_attacks(attack_class, options):
+    torch.manual_seed(0)
+    model, x_data, y_data, threat_model = _tiny_classifier()
+    step = {'alpha': .1} if attack_class is attacks.ProjectedGradientDescent else {'eta': .1}
+    attack = attack_class(threat_model, iterations=20, restarts=3, device=torch.device('cpu'), **step, **options)
+    x_adv = attack.apply(model, x_data, y_data)
+
+    assert x_adv.shape == x_data.shape
+    assert (x_adv - x_data).abs().max() <= .5 + 1e-6, 'Adversarial examples exceed the budget'
+    assert x_adv.min() >= 0 and x_adv.max() <= 1, 'Adversarial examples exceed the bounds'
+    if 'tol' not in options:
+        assert (model(x_adv).argmax(dim=1) != y_data).all(), 'Not all samples were fooled'
+
+def test_restart_selection():
+    # the first restart fools the model with a lower loss than the second one, which does not fool it
+    x_data = torch.zeros(2, 1)
+    y_data = torch.zeros(2, dtype=torch.long)
+    x_restarts = torch.tensor([[[1.], [1.]], [[2.], [2.]]])
+    losses = -torch.log(torch.tensor([[.40, .40], [.35, .35]]))
+    fooled = torch.tensor([[True, False], [False, False]])
+
+    for batched in [False, True]:
+        calls = []
+        def run(x, y):
+            start, n = sum(calls), x.shape[0] // 2
+            calls.append(n)
+            return x_restarts[start:start + n].flatten(0, 1), losses[start:start + n].flatten(), fooled[start:start + n].flatten()
+        x_best = _restarts(run, x_data, y_data, 2, batched, None)
+
+        # sample 0 keeps the fooling restart, sample 1 the restart with the highest loss
+        assert x_best.view(-1).tolist() == [1., 2.]
+
+class _StageAttack(attacks.Attack):
+    """
+    Attack that fools the samples with the given identifiers and records the identifiers it receives.
+    """
+    def __init__(self, threat_model, fooled, queries):
+        super().__init__(threat_model)
+        self.fooled = torch.tensor(fooled)
+        self.queries = queries
+        self.received = []
+
+    def apply(self, model, x_data, y_data):
+        ids = x_data[:, 1]
+        self.received.append(ids.long().tolist())
+        x_adv = x_data.clone()
+        x_adv[:, 0] = torch.where(torch.isin(ids.long(), self.fooled), 1., x_data[:, 0])
+        return x_adv
+
+    def statistics(self):
+        return {'Queries': torch.full((len(self.received[-1]),), self.queries)}
+
+def test_cascade():
+    # the model predicts the first feature as class, the second feature identifies the sample
+    model = lambda x: torch.nn.functional.one_hot(x[:, 0].long(), 2).float()
+    x_data = torch.tensor([[0., 0.], [0., 1.], [0., 2.], [1., 3.]])
+    y_data = torch.zeros(4, dtype=torch.long)
+
+    threat_model = threats.Linf(1)
+    first, second = _StageAttack(threat_model, [0], 1), _StageAttack(threat_model, [1], 10)
+    cascade = attacks.Cascade([first, second])
+    x_adv = cascade.apply(model, x_data, y_data)
+
+    # sample 3 is misclassified without perturbation, later stages only attack the survivors
+    assert first.received == [[0, 1, 2]]
+    assert second.received == [[1, 2]]
+    assert x_adv[:, 0].tolist() == [1., 1., 0., 1.]
+
+    statistics = cascade.statistics()
+    assert statistics['Stage'].tolist() == [1, 2, 2, 0]
+    assert statistics['Queries'].tolist() == [1, 11, 11, 0]
+
+def test_idct2():
+    fft = pytest.importorskip('scipy.fft')
+    torch.manual_seed(0)
+    x = torch.randn(2, 3, 8, 6, dtype=torch.float64)
+    expected = fft.idctn(x.numpy(), axes=(-2, -1), norm='ortho')
+    assert torch.allclose(attacks.simba.idct2(x), torch.from_numpy(expected)), 'idct2 does not match scipy'
+
+@pytest.mark.parametrize('candidates', [1, 3])
+@pytest.mark.parametrize('basis', ['standard', 'dct'])
+def test_simba(basis, candidates):
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(3 * 4 * 4, 3), torch.nn.LogSoftmax(dim=1))
+    x_data = torch.rand(8, 3, 4, 4)
+    with torch.no_grad():
+        y_pred = model(x_data)
+    # flip the labels of the first two samples, so they are misclassified from the start
+    y_data = y_pred.argmax(dim=1)
+    y_data[:2] = (y_data[:2] + 1) % 3
+    threat_model = threats.Composite([threats.Linf(.1), threats.Bounds(0, 1)])
+
+    attack = attacks.Simba(threat_model, iterations=50, eps=.05, basis=basis, candidates=candidates)
+    x_adv = attack.apply(model, x_data, y_data)
+    assert (x_adv - x_data).abs().max() <= .1 + 1e-6, 'Adversarial examples exceed the budget'
+    assert x_adv.min() >= 0 and x_adv.max() <= 1, 'Adversarial examples exceed the bounds'
+    assert (attack.statistics()['Queries'] == 1 + 50 * candidates).all()
+
+    # only improving candidates are accepted, so the score of the true class never increases
+    with torch.no_grad():
+        y_score = model(x_adv).gather(1, y_data.view(-1, 1))
+    assert (y_score <= y_pred.gather(1, y_data.view(-1, 1)) + 1e-6).all(), 'Simba increased the score of the true class'
+
+    attack = attacks.Simba(threat_model, iterations=50, eps=.05, basis=basis, candidates=candidates, max_queries=10, early_stop=True)
+    attack.apply(model, x_data, y_data)
+    queries = attack.statistics()['Queries']
+    assert (queries <= 10).all(), 'Simba exceeded the query budget'
+    assert (queries[:2] == 1).all(), 'Simba queried samples that were misclassified from the start'
+
+@pytest.mark.parametrize('make_attack', [
+    lambda threat_model: attacks.ProjectedGradientDescent(threat_model, iterations=5, alpha=.1, device=torch.device('cpu')),
+    lambda threat_model: attacks.FastGradientSignMethod(threat_model, eps=.1, sigma=.1),
+    lambda threat_model: attacks.Cascade([attacks.FastGradientSignMethod(threat_model, eps=.1),
+                                          attacks.ProjectedGradientDescent(threat_model, iterations=5, alpha=.1, device=torch.device('cpu'))]),
+])
+@pytest.mark.parametrize('fused', [True, False])
+def test_bounds_checked_once(monkeypatch, make_attack, fused):
+    torch.manual_seed(0)
+    model, x_data, y_data, _ = _tiny_classifier()
+    # data exceeds the bounds of the threat model, so every reduction emits a warning
+    x_data = 1.5 * x_data
+    # two balls cannot be fused, so the threat models are projected one after another
+    ball = threats.Linf(.5) if fused else threats.L2(.5)
+    bounds = threats.Bounds(0, 1)
+    threat_model = threats.Composite([ball, bounds]) if fused else threats.Composite([ball, threats.L1(5), bounds])
+
+    # count the checks that actually reduce over the data
+    reductions = []
+    check = threats.Bounds._check
+    def counting_check(self, x_orig):
+        if not self.bound_:
+            reductions.append(x_orig.shape[0])
+        return check(self, x_orig)
+    monkeypatch.setattr(threats.Bounds, '_check', counting_check)
+
+    with pytest.warns(UserWarning) as record:
+        make_attack(threat_model).apply(model, x_data, y_data)
+    assert reductions == [x_data.shape[0]], 'Bounds were checked more than once per batch'
+    assert len(record) == 1
@@ -1,9 +1,14 @@
+import pytest
+
+import torch
+
 from robusthub import threats
 from robusthub import models
 from robusthub import defenses
 from robusthub import benchmarks
 from robusthub import attacks
 from robusthub import metrics
+from robusthub.execution import ExecutionPolicy
 
 def test_benchmark(trainloader, testloader, device):
     # load model
@@ -24,3 +29,111 @@ def test_benchmark(trainloader, testloader, device):
     result = benchmark.run(model, defense, testloader)
 
     print(result)
+
+def test_fused_benchmark(testloader, device):
+    # load model
+    model = models.load('pytorch/vision', 'resnet18').to(device)
+
+    # define threat model
+    threat_model = threats.Composite([
+        threats.Linf(.03),
+        threats.Bounds(0, 1)])
+
+    # run benchmark in a single pass over the data
+    attack = attacks.FastGradientSignMethod(threat_model)
+    metric_list = [metrics.Accuracy()]
+    benchmark = benchmarks.Benchmark(attack, metric_list, device, fused=True)
+    result = benchmark.run(model, defenses.Vanilla(), testloader)
+
+    flags = [r['flags'] for r in result.record]
+    assert benchmarks.ResultFlags.AGNOSTIC | benchmarks.ResultFlags.MODEL | benchmarks.ResultFlags.STANDARD in flags
+    assert benchmarks.ResultFlags.AGNOSTIC | benchmarks.ResultFlags.MODEL | benchmarks.ResultFlags.ROBUST in flags
+    assert benchmarks.ResultFlags.SPECIFIC | benchmarks.ResultFlags.ROBUST in flags
+
+def test_epsilon_benchmark(testloader, device):
+    # load model
+    model = models.load('pytorch/vision', 'resnet18').to(device)
+
+    # define threat model
+    threat_model = threats.Composite([
+        threats.Linf(8 / 255),
+        threats.Bounds(-1, 1)])
+
+    # record robust accuracy at several budgets with a single attack
+    epsilons = [1 / 255, 2 / 255, 4 / 255, 8 / 255]
+    attack = attacks.ProjectedGradientDescent(threat_model, iterations=2, restarts=1, device=device)
+    benchmark = benchmarks.Benchmark(attack, [metrics.Accuracy()], device, fused=True, epsilons=epsilons)
+    result = benchmark.run(model, defenses.Vanilla(), testloader)
+
+    curve = [r['value'].mean for r in result.record if r['metric'].startswith('Accuracy(eps=')]
+    assert len(curve) == len(epsilons)
+    assert all(a >= b for a, b in zip(curve, curve[1:])), 'Robust accuracy increases with the budget'
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='Requires CUDA')
+def test_benchmark_no_sync(testloader):
+    device = torch.device('cuda')
+    model = models.load('pytorch/vision', 'resnet18').to(device)
+    attack = attacks.FastGradientSignMethod(threats.Linf(.03))
+    policy = ExecutionPolicy()
+    evaluation = benchmarks._Evaluation(attack, [metrics.Accuracy(), metrics.MCC()], policy)
+
+    batches = iter(testloader)
+    for sync_mode in ['default', 'error']:
+        x_data, y_data = next(batches)
+        x_data, y_data = x_data.to(device), y_data.to(device)
+        torch.cuda.synchronize()
+
+        # the first batch warms up the model, the second one must not synchronize with the host
+        torch.cuda.set_sync_debug_mode(sync_mode)
+        try:
+            evaluation.update(model, x_data, y_data, policy(model, x_data))
+        finally:
+            torch.cuda.set_sync_debug_mode('default')
+
+def test_eval_mode():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(
+        torch.nn.Conv2d(3, 4, 3, padding=1),
+        torch.nn.BatchNorm2d(4),
+        torch.nn.Flatten(),
+        torch.nn.Linear(4 * 4 * 4, 3),
+        torch.nn.BatchNorm1d(3))
+    model[4].eval()
+    running_mean = model[1].running_mean.clone()
+    dataset = torch.utils.data.TensorDataset(torch.rand(16, 3, 4, 4), torch.randint(0, 3, (16,)))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=8)
+
+    # the model is in training mode, except for a deliberately frozen layer
+    attack = attacks.FastGradientSignMethod(threats.Linf(.1))
+    benchmark = benchmarks.Benchmark(attack, [metrics.Accuracy()], torch.device('cpu'))
+    benchmark.run(model, defenses.Vanilla(), loader)
+
+    assert torch.equal(model[1].running_mean, running_mean), 'Batch normalization statistics changed during the benchmark'
+    assert model[1].training and not model[4].training, 'Training modes of modules were not restored'
+
+class _ComputeOnlyAccuracy(metrics.Metric):
+    """
+    Metric in the style of older versions, which only implements compute.
+    """
+    def __init__(self):
+        super().__init__('ComputeOnlyAccuracy', (0, 1))
+
+    def compute(self, model, x_data, y_data):
+        y_pred = model(x_data)
+        return torch.mean((y_pred.argmax(dim=1) == y_data).float()).item()
+
+def test_compute_only_metric():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(12, 3))
+    dataset = torch.utils.data.TensorDataset(torch.rand(16, 3, 2, 2), torch.randint(0, 3, (16,)))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=8)
+
+    attack = attacks.FastGradientSignMethod(threats.Linf(.1))
+    benchmark = benchmarks.Benchmark(attack, [metrics.Accuracy(), _ComputeOnlyAccuracy()], torch.device('cpu'))
+    result = benchmark.run(model, defenses.Vanilla(), loader)
+
+    # the compute-only metric agrees with its counterpart that scores shared predictions
+    values = {(r['metric'], r['flags']): r['value'].mean for r in result.record}
+    for setting in [benchmarks.ResultFlags.STANDARD, benchmarks.ResultFlags.ROBUST]:
+        flags = benchmarks.ResultFlags.SPECIFIC | setting
+        assert abs(values[('Accuracy', flags)] - values[('ComputeOnlyAccuracy', flags)]) < 1e-6
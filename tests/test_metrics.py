@@ -1,7 +1,12 @@
+import torch
+
 import numpy as np
 
+from sklearn.metrics import accuracy_score, f1_score, matthews_corrcoef, roc_auc_score, roc_curve
+
 from robusthub import models
 from robusthub import metrics
+from robusthub.execution import ExecutionPolicy
 
 def test_at(testloader, device):
     # load model
@@ -14,3 +19,74 @@ def test_at(testloader, device):
     for x_data, y_data in testloader:
         accs.append(accuracy.compute(model, x_data.to(device), y_data.to(device)))
     print(f'Accuracy: {np.sum(accs) / len(testloader):.2%}')
+
+def test_accumulators():
+    torch.manual_seed(0)
+    y_pred = torch.randn(100, 2)
+    y_data = torch.randint(0, 2, (100,))
+    labels = y_pred.argmax(dim=1).numpy()
+
+    # accumulate over uneven batches and shards
+    for metric, reference in [(metrics.Accuracy(), accuracy_score),
+                              (metrics.F1(), f1_score),
+                              (metrics.MCC(), matthews_corrcoef)]:
+        first, second = metric.accumulator(), metric.accumulator()
+        for i in range(0, 70, 32):
+            first.update(y_pred[i:min(i + 32, 70)], y_data[i:min(i + 32, 70)])
+        second.update(y_pred[70:], y_data[70:])
+        value, _ = first.merge(second).result()
+        assert np.isclose(value, reference(y_data.numpy(), labels)), f'{metric.name} does not match reference'
+
+    # per-sample metrics
+    y_pred, y_data = torch.randn(10, 3), torch.randn(10, 3)
+    accumulator = metrics.MSE().accumulator()
+    accumulator.update(y_pred[:7], y_data[:7])
+    accumulator.update(y_pred[7:], y_data[7:])
+    value, _ = accumulator.result()
+    assert np.isclose(value, torch.mean(torch.square(y_pred - y_data)).item())
+
+def test_roc_accumulators():
+    torch.manual_seed(0)
+    y_data = torch.randint(0, 2, (1000,))
+    y_pred = torch.clamp(.3 * y_data + .7 * torch.rand(1000), 0, 1)
+
+    auc_acc, tpr_acc = metrics.AUC().accumulator(), metrics.TPR(.1).accumulator()
+    for i in range(0, 1000, 128):
+        auc_acc.update(y_pred[i:i + 128], y_data[i:i + 128])
+        tpr_acc.update(y_pred[i:i + 128], y_data[i:i + 128])
+
+    fpr, tpr, _ = roc_curve(y_data.numpy(), y_pred.numpy())
+    assert np.isclose(auc_acc.result()[0], roc_auc_score(y_data.numpy(), y_pred.numpy()), atol=1e-2)
+    assert np.isclose(tpr_acc.result()[0], tpr[np.searchsorted(fpr, .1, side='right') - 1], atol=1e-2)
+
+    # batches containing a single class are fine
+    accumulator = metrics.AUC().accumulator()
+    accumulator.update(torch.ones(4), torch.ones(4, dtype=torch.long))
+    accumulator.update(torch.zeros(4), torch.zeros(4, dtype=torch.long))
+    assert np.isclose(accumulator.result()[0], 1)
+
+def test_image_metrics():
+    torch.manual_seed(0)
+    y_data = torch.rand(8, 3, 16, 16)
+    y_pred = torch.clamp(y_data + .05 * torch.randn_like(y_data), 0, 1)
+
+    ssim, psnr = metrics.SSIM(data_range=1), metrics.PSNR(data_range=1)
+    assert ssim.samples(y_pred, y_data).shape == (8,)
+    assert torch.allclose(ssim.samples(y_data, y_data), torch.ones(8))
+    assert ssim.samples(y_pred, y_data).max() < 1
+
+    mse = torch.mean(torch.square(y_pred - y_data), dim=(1, 2, 3))
+    assert torch.allclose(psnr.samples(y_pred, y_data), -10 * torch.log10(mse))
+
+def test_channels_last_metrics():
+    torch.manual_seed(0)
+    x_data = torch.rand(8, 3, 16, 16)
+    model = torch.nn.Conv2d(3, 3, 3, padding=1)
+
+    # image-to-image outputs of channels last models are scored like standard outputs
+    policy = ExecutionPolicy(channels_last=True)
+    model = policy.prepare(model)
+    with torch.no_grad():
+        y_pred = model(x_data)
+    expected = torch.mean(torch.square(y_pred - x_data)).item()
+    assert np.isclose(metrics.MSE().compute(model, x_data, x_data, policy), expected, rtol=1e-5)
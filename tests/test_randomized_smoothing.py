@@ -1,5 +1,10 @@
+import torch
+import torch.nn.functional as F
+
 from robusthub import models
 from robusthub import defenses
+from robusthub import threats
+from robusthub import attacks
 
 def test_rs(trainloader, testloader, device):
     # load model
@@ -19,3 +24,76 @@ def test_rs(trainloader, testloader, device):
         correct += (y_batch.cpu().detach().numpy() == y_pred.cpu().detach().numpy()).sum()
         total += x_batch.shape[0]
     print(f'Accuracy: {correct/total:.2%}')
+
+def test_certify(testloader, device):
+    # load model
+    model = models.load('pytorch/vision', 'resnet18').to(device)
+
+    # smooth model
+    rs_model = defenses.RandomizedSmoothing(100, .25, 1000, max_batch_size=1024).apply(model)
+
+    # certify a single batch with early stopping
+    x_batch, _ = next(iter(testloader))
+    predictions, radii = rs_model.certify(x_batch.to(device), n0=10, n=100, alpha=.001, looks=4)
+
+    assert predictions.shape == radii.shape == (x_batch.shape[0],)
+    assert (radii >= 0).all() and (radii[predictions == -1] == 0).all(), 'Abstentions have nonzero radius'
+
+def test_eot(testloader, device):
+    # load model
+    model = models.load('pytorch/vision', 'resnet18').to(device)
+
+    # smooth model with a differentiable surrogate
+    rs_model = defenses.RandomizedSmoothing(10, .25, 1000, eot_samples=4).apply(model)
+
+    # attack the smoothed model with gradients averaged over the noise
+    threat_model = threats.Composite([threats.Linf(.03), threats.Bounds(-1, 1)])
+    attack = attacks.FastGradientSignMethod(threat_model)
+    x_batch, y_batch = next(iter(testloader))
+    x_adv = attack.apply(rs_model, x_batch.to(device), y_batch.to(device))
+
+    assert x_adv.shape == x_batch.shape
+
+def test_eot_finite_gradients():
+    # a model that is extremely confident in the wrong class
+    model = torch.nn.Linear(4, 3)
+    with torch.no_grad():
+        model.weight.zero_()
+        model.bias.copy_(torch.tensor([-1000., 1000., 0.]))
+    surrogate = defenses.RandomizedSmoothing(10, .1, 3, eot_samples=4).apply(model).surrogate()
+
+    x = torch.ones(2, 4, requires_grad=True)
+    loss = F.nll_loss(surrogate(x), torch.zeros(2, dtype=torch.long))
+    grad, = torch.autograd.grad(loss, x)
+
+    assert torch.isfinite(loss), 'Loss of the surrogate is not finite'
+    assert torch.isfinite(grad).all(), 'Gradients of the surrogate are not finite'
+
+def _linear_smoothed(sigma, max_batch_size=None):
+    torch.manual_seed(0)
+    model = torch.nn.Linear(4, 3)
+    return defenses.RandomizedSmoothing(10, sigma, 3, max_batch_size=max_batch_size).apply(model)
+
+def test_counts():
+    x = torch.randn(4, 4)
+
+    # every noise draw votes for exactly one class
+    for max_batch_size in [None, 8, 3]:
+        rs_model = _linear_smoothed(.5, max_batch_size)
+        assert (rs_model.counts(x, 25).sum(dim=1) == 25).all(), 'Counts do not sum to the number of draws'
+
+    # without noise, chunked and unchunked counts agree and all votes go to the prediction of the base model
+    counts = _linear_smoothed(0).counts(x, 25)
+    assert torch.equal(_linear_smoothed(0, 8).counts(x, 25), counts), 'Chunked counts differ from unchunked counts'
+    with torch.no_grad():
+        y_pred = _linear_smoothed(0).model(x).argmax(dim=1)
+    assert (counts.gather(1, y_pred.view(-1, 1)) == 25).all()
+
+def test_certify_more_looks_than_draws():
+    # some looks have no draws at all
+    rs_model = _linear_smoothed(.25)
+    x = torch.randn(4, 4)
+    predictions, radii = rs_model.certify(x, n0=10, n=3, alpha=.1, looks=5)
+
+    assert not torch.isnan(radii).any(), 'Certified radii contain NaN'
+    assert (radii >= 0).all() and (radii[predictions == -1] == 0).all()
@@ -41,3 +41,48 @@ def test_bounds(testloader):
         assert x_proj.shape == x_batch.shape, 'Shapes of projected samples do not match originals'
 
         assert x_proj.max() <= 1 and x_proj.min() >= 0
+
+def test_composite(testloader):
+    eps = .03
+    threat = threats.Composite([threats.Linf(eps), threats.Bounds(-1, 1)])
+    assert threat.fused, 'Linf and Bounds are not fused'
+    for batch in testloader:
+        x_batch, _ = batch
+        x_tilde = x_batch + 100 * torch.randn(x_batch.shape)
+        x_proj = threat.project(x_batch, x_tilde)
+        x_seq = torch.clamp(torch.clamp(x_tilde, x_batch - eps, x_batch + eps), -1, 1)
+
+        assert torch.allclose(x_proj, x_seq), 'Fused projection does not match sequential projection'
+
+def test_l1(testloader):
+    eps = 10
+    threat = threats.L1(eps)
+    composite = threats.Composite([threats.L1(eps), threats.Bounds(-1, 1)])
+    for batch in testloader:
+        x_batch, _ = batch
+        x_tilde = x_batch + torch.randn(x_batch.shape)
+        x_proj = threat.project(x_batch, x_tilde)
+        
+        assert x_proj.shape == x_batch.shape, 'Shapes of projected samples do not match originals'
+
+        norms = torch.linalg.vector_norm(x_batch.view(x_batch.shape[0], -1) - x_proj.view(x_batch.shape[0], -1), ord=1, dim=1).cpu().numpy()
+        assert all([np.isclose(norm, eps, rtol=1e-4) for norm in norms]), 'Projected samples are not on the boundary of the threat model'
+
+        x_proj = composite.project(x_batch, x_tilde)
+        norms = torch.linalg.vector_norm(x_batch.view(x_batch.shape[0], -1) - x_proj.view(x_batch.shape[0], -1), ord=1, dim=1).cpu().numpy()
+        assert all([norm <= eps or np.isclose(norm, eps) for norm in norms]), 'Projected samples are not within threat model'
+        assert x_proj.max() <= 1 and x_proj.min() >= -1
+
+def test_composite_cache():
+    threat = threats.Composite([threats.Linf(.1), threats.Bounds(None, None)])
+    x_buffer = torch.zeros(2, 3)
+    threat.project(x_buffer, x_buffer + 1)
+
+    # reusing a buffer in place outside of bind must not reuse stale bounds
+    x_buffer.fill_(5.)
+    assert torch.allclose(threat.project(x_buffer, x_buffer + 1), torch.full((2, 3), 5.1))
+
+    # bounds are only cached while bound
+    with threat.bind(x_buffer):
+        assert threat.box_ is not None
+    assert threat.box_ is None and threat.x_orig_ is None